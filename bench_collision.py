@@ -0,0 +1,113 @@
+"""Benchmarks the Rect, tile and numpy box tests: python bench_collision.py [--boxes N ...] [--output FILE]"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+import pygame
+
+import collision
+
+# Width and height in pixels of a tile, as in the game
+TILE_SIZE = 30
+
+
+def random_boxes(count, columns, rows, seed=0):
+    """Make boxes of 1 to 2 tiles a side, like the game's colliders.
+
+    :return: A list of (x, y, width, height) tuples.
+    """
+    rng = random.Random(seed)
+    return [(rng.randrange(columns), rng.randrange(rows), rng.randint(1, 2), rng.randint(1, 2))
+            for _ in range(count)]
+
+
+def rect_pairs(box, boxes):
+    """The old test: build a pair of pixel Rects for every test."""
+    x, y, width, height = box
+    hits = 0
+    for other_x, other_y, other_width, other_height in boxes:
+        one = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, width * TILE_SIZE, height * TILE_SIZE)
+        two = pygame.Rect(other_x * TILE_SIZE, other_y * TILE_SIZE, other_width * TILE_SIZE, other_height * TILE_SIZE)
+        hits += one.colliderect(two)
+    return hits
+
+
+def tile_pairs(box, boxes):
+    """The integer test, one pair at a time."""
+    x, y, width, height = box
+    overlaps = collision.overlaps
+    hits = 0
+    for other_x, other_y, other_width, other_height in boxes:
+        hits += overlaps(x, y, width, height, other_x, other_y, other_width, other_height)
+    return hits
+
+
+def batched_pairs(box, arrays):
+    """The integer test, one box against all of them at once."""
+    return int(collision.overlaps_many(*box, *arrays).sum())
+
+
+def bench(count, columns=30, rows=30, seed=0, repeat=20):
+    """Time each test on count boxes, each tested against all of them.
+
+    :return: A dict of pair tests per second for each test.
+    """
+    boxes = random_boxes(count, columns, rows, seed)
+    arrays = tuple(np.array(column, dtype=np.int32) for column in zip(*boxes))
+    tests = {
+        'rect': lambda box: rect_pairs(box, boxes),
+        'tile': lambda box: tile_pairs(box, boxes),
+        'batched': lambda box: batched_pairs(box, arrays),
+    }
+
+    results = {}
+    hits = set()
+    for name, test in tests.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            total = sum(test(box) for box in boxes)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        hits.add(total)
+        results[name] = count * count / best
+    # every test has to find the same overlaps
+    if len(hits) != 1:
+        raise AssertionError("the tests disagree on the number of overlaps: %s" % sorted(hits))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark collision tests between boxes of tiles.")
+    parser.add_argument('--boxes', type=int, nargs='+', default=[10, 100, 1000],
+                        help="numbers of boxes to test against each other (default: 10 100 1000)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the boxes (default: 0)")
+    parser.add_argument('--repeat', type=int, default=5, help="runs of each test, the best one counts (default: 5)")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = {'python': platform.python_version(),
+               'numpy': np.__version__,
+               'pygame': pygame.version.ver,
+               'seed': args.seed,
+               'repeat': args.repeat,
+               'boxes': {}}
+    for count in args.boxes:
+        result = bench(count, seed=args.seed, repeat=args.repeat)
+        results['boxes'][str(count)] = result
+        print("%d boxes:" % count)
+        for name, rate in result.items():
+            print("  %-8s %14.0f pair tests/sec  x%.1f" % (name, rate, rate / result['rect']))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
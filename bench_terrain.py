@@ -0,0 +1,171 @@
+"""Benchmarks terrain generation stage by stage: python bench_terrain.py [--output FILE] [--baseline FILE]"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import terrain_gen
+
+# Terrain sizes, as (columns, rows) of the whole terrain. A chunk is half the rows.
+SIZES = ((30, 60), (60, 120), (150, 300), (300, 600))
+
+
+def _measure(stage, repeat):
+    """Time repeated calls of stage, then trace the allocations of one more.
+
+    :return: A dict of timings in milliseconds, and the peak allocation in KiB.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+
+    # traced separately, since tracing slows every allocation down
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'calls': repeat,
+            'mean_ms': sum(times) / repeat * 1000,
+            'min_ms': min(times) * 1000,
+            'max_ms': max(times) * 1000,
+            'peak_kib': peak / 1024}
+
+
+def bench_size(columns, rows, seed=0, repeat=20):
+    """Benchmark every stage of the terrain pipeline at one terrain size.
+
+    :param columns: Width of the terrain, in tiles.
+    :param rows: Height of the whole terrain, in tiles. Chunks are half of it.
+    :param seed: Terrain seed to generate with.
+    :param repeat: How many times to run each stage.
+    :return: A dict of results, see main.
+    """
+    chunk_rows = rows // 2
+    generator = terrain_gen.ChunkGenerator(columns, chunk_rows)
+    rules = terrain_gen.SpawnRules()
+    below = terrain_gen.initial_rows(columns, chunk_rows)
+    below_spans = terrain_gen.water_spans(below)
+
+    # inputs for the stages, all from the same seed
+    grid = terrain_gen.initialize_map(chunk_rows, columns, generator.start_alive_prob,
+                                      terrain_gen.chunk_rng(seed, 0).random)
+    chunks = generator.chunks(seed, below, rules)
+    prepared = [next(chunks) for _ in range(4)]
+    terrain = terrain_gen.Terrain(1, columns, rows)
+
+    def build_chunk():
+        generator.build_chunk(terrain_gen.chunk_rng(seed, 1), 1, below_spans, generator.carving_center, rules)
+
+    def load_chunk():
+        chunk = prepared[0]
+        terrain.set_tiles(slice(None), slice(0, chunk_rows), chunk.tiles, chunk.shades, chunk.spans)
+
+    # scrolls a whole chunk's worth of rows, loading the next chunk at the boundary
+    def scroll_chunk():
+        for _ in range(chunk_rows):
+            terrain.scroll_pos -= 1
+            if terrain.scroll_pos == chunk_rows - 1:
+                terrain.advance_chunk()
+                load_chunk()
+                terrain.scroll_pos = rows - 1
+            terrain.scroll_visible()
+
+    stages = {
+        'initialize_map': lambda: terrain_gen.initialize_map(chunk_rows, columns, generator.start_alive_prob,
+                                                             terrain_gen.chunk_rng(seed, 0).random),
+        'count_live_neighbors': lambda: terrain_gen.count_live_neighbors(grid),
+        'sim_step': lambda: terrain_gen.sim_step(grid, generator.neighbors_for_murder, generator.neighbors_for_rebirth),
+        'generate_noise': lambda: generator.generate_noise(terrain_gen.chunk_rng(seed, 0)),
+        'water_spans': lambda: terrain_gen.water_spans(prepared[0].tiles),
+        'plan_spawns': lambda: rules.plan(prepared[0].spans + below_spans, columns, chunk_rows, 1, terrain_gen.chunk_rng(seed, 0)),
+        'build_chunk': build_chunk,
+        'load_chunk': load_chunk,
+        'scroll_chunk': scroll_chunk,
+    }
+    results = {name: _measure(stage, repeat) for name, stage in stages.items()}
+
+    # chunks/sec over a whole episode, chunk after chunk
+    start = time.perf_counter()
+    chunks = generator.chunks(seed, below, rules)
+    for _ in range(repeat):
+        next(chunks)
+    chunks_per_sec = repeat / (time.perf_counter() - start)
+
+    return {'columns': columns, 'rows': rows, 'chunks_per_sec': chunks_per_sec, 'stages': results}
+
+
+def compare(results, baseline, tolerance):
+    """Print how the results compare with a baseline.
+
+    :param tolerance: How much slower than the baseline a stage can be, as a fraction.
+    :return: The number of stages that got slower than that.
+    """
+    regressions = 0
+    for size, result in results['sizes'].items():
+        base = baseline['sizes'].get(size)
+        if base is None:
+            print("%s: not in the baseline" % size)
+            continue
+        print("%s: %.1f chunks/sec, baseline %.1f" % (size, result['chunks_per_sec'], base['chunks_per_sec']))
+        for name, stage in result['stages'].items():
+            base_stage = base['stages'].get(name)
+            if base_stage is None:
+                continue
+            ratio = stage['mean_ms'] / base_stage['mean_ms']
+            slower = ratio > 1 + tolerance
+            regressions += slower
+            print("  %-22s %9.3f ms  baseline %9.3f ms  x%.2f%s" % (
+                name, stage['mean_ms'], base_stage['mean_ms'], ratio, "  SLOWER" if slower else ""))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark terrain generation.")
+    parser.add_argument('--sizes', nargs='+', metavar='COLUMNSxROWS',
+                        help="terrain sizes to run (default: %s)" % " ".join("%dx%d" % size for size in SIZES))
+    parser.add_argument('--seed', type=int, default=0, help="terrain seed (default: 0)")
+    parser.add_argument('--repeat', type=int, default=20, help="runs of each stage (default: 20)")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare with results from an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="fraction slower than the baseline that still passes (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    sizes = SIZES
+    if args.sizes:
+        sizes = [tuple(int(n) for n in size.split('x')) for size in args.sizes]
+
+    results = {'python': platform.python_version(),
+               'numpy': np.__version__,
+               'seed': args.seed,
+               'repeat': args.repeat,
+               'sizes': {}}
+    for columns, rows in sizes:
+        result = bench_size(columns, rows, args.seed, args.repeat)
+        results['sizes']['%dx%d' % (columns, rows)] = result
+        print("%dx%d: %.1f chunks/sec" % (columns, rows, result['chunks_per_sec']))
+        for name, stage in result['stages'].items():
+            print("  %-22s mean %9.3f ms  min %9.3f ms  peak %9.1f KiB" % (
+                name, stage['mean_ms'], stage['min_ms'], stage['peak_kib']))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
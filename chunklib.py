@@ -0,0 +1,199 @@
+"""Libraries of pre-generated terrain chunks, stored in one memory-mapped file.
+
+A chunk library holds the chunks of a number of episodes. Each episode is
+generated from its own seed, exactly as the game would generate it. Loading
+a chunk from a library is just indexing into the mapped file, so episodes
+replayed from one cost next to nothing to set up.
+
+The file is a header, the seed of every episode, and then one fixed-size
+record per chunk, episode by episode.
+
+Build a library, and look at one, with::
+
+    python chunklib.py build terrain.chunks --episodes 100 --chunks 50
+    python chunklib.py info terrain.chunks
+"""
+import argparse
+import struct
+import time
+
+import numpy as np
+
+import terrain_gen
+
+MAGIC = b'RRCHUNKS'
+VERSION = 1
+
+# magic, version, columns, rows, max_spawns, episodes, chunks per episode
+_HEADER = struct.Struct('<8s6I')
+
+SPAWN_DTYPE = np.dtype([('kind', 'u1'), ('args', '<i2', (3,))])
+
+
+def record_dtype(columns, rows, max_spawns):
+    """Get the numpy dtype of one chunk record."""
+    return np.dtype([('tiles', 'u1', (columns, rows)),
+                     ('shades', 'u1', (columns, rows)),
+                     ('carving_center', '<i2'),
+                     ('spawn_count', '<u2'),
+                     ('spawns', SPAWN_DTYPE, (max_spawns,))])
+
+
+def _seeds_offset():
+    return _HEADER.size
+
+
+def _records_offset(episodes):
+    return _HEADER.size + 8 * episodes
+
+
+def write_library(path, generator, seeds, chunks_per_episode, rules=None):
+    """Generate the chunks of every episode, and write them to a library file.
+
+    :param path: File to write.
+    :param generator: The terrain_gen.ChunkGenerator to generate chunks with.
+    :param seeds: The terrain seed of each episode.
+    :param chunks_per_episode: How many chunks to generate for each episode.
+    :param rules: The terrain_gen.SpawnRules to plan spawns with.
+    """
+    if chunks_per_episode < 1:
+        raise ValueError("a chunk library needs at least one chunk per episode")
+    if rules is None:
+        rules = terrain_gen.SpawnRules()
+    # every enemy attempt, fuel strip attempt, bridge and shield can spawn once
+    max_spawns = rules.enemy_spawn_attempts(chunks_per_episode) + rules.fuel_strip_spawn_attempts + 2
+    dtype = record_dtype(generator.columns, generator.rows, max_spawns)
+    below = terrain_gen.initial_rows(generator.columns, generator.rows)
+
+    with open(path, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, generator.columns, generator.rows, max_spawns,
+                                len(seeds), chunks_per_episode))
+        file.write(np.asarray(seeds, dtype='<u8').tobytes())
+        # written one episode at a time, so big libraries never sit in memory
+        records = np.zeros(chunks_per_episode, dtype=dtype)
+        for seed in seeds:
+            records[:] = 0
+            chunks = generator.chunks(seed, below, rules)
+            for record in records:
+                chunk = next(chunks)
+                record['tiles'] = chunk.tiles
+                record['shades'] = chunk.shades
+                record['carving_center'] = chunk.carving_center
+                record['spawn_count'] = len(chunk.spawns)
+                for spawn, (kind, *args) in zip(record['spawns'], chunk.spawns):
+                    spawn['kind'] = terrain_gen.SPAWN_KINDS.index(kind)
+                    spawn['args'][:len(args)] = args
+            file.write(records.tobytes())
+
+
+class ChunkLibrary:
+    """A chunk library file, memory-mapped for reading.
+
+    :param path: The library file, see write_library.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            header = file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError("%s is not a chunk library" % path)
+        magic, version, columns, rows, max_spawns, episodes, chunks_per_episode = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("%s is not a chunk library" % path)
+        if version != VERSION:
+            raise ValueError("%s is a version %d chunk library, expected version %d" % (path, version, VERSION))
+
+        self.path = path
+        self.columns = columns
+        self.rows = rows
+        self.max_spawns = max_spawns
+        self.episodes = episodes
+        self.chunks_per_episode = chunks_per_episode
+        self.seeds = np.memmap(path, dtype='<u8', mode='r', offset=_seeds_offset(), shape=(episodes,))
+        self.records = np.memmap(path, dtype=record_dtype(columns, rows, max_spawns), mode='r',
+                                 offset=_records_offset(episodes), shape=(episodes, chunks_per_episode))
+
+    def __len__(self):
+        return self.episodes
+
+    def seed(self, episode):
+        """Get the terrain seed an episode was generated from."""
+        return int(self.seeds[episode])
+
+    def chunk(self, episode, index):
+        """Get one chunk of an episode.
+
+        The tiles and shades of the chunk are read-only views into the file.
+
+        :param episode: The number of the episode, counting from 0.
+        :param index: The number of the chunk in the episode, counting from 1.
+        :return: A terrain_gen.Chunk.
+        """
+        record = self.records[episode, index - 1]
+        spawns = []
+        for kind, args in record['spawns'][:record['spawn_count']].tolist():
+            kind = terrain_gen.SPAWN_KINDS[kind]
+            spawns.append((kind,) + tuple(args[:terrain_gen.SPAWN_ARGS[kind]]))
+        return terrain_gen.Chunk(index,
+                                 self.records['tiles'][episode, index - 1],
+                                 self.records['shades'][episode, index - 1],
+                                 spawns,
+                                 int(record['carving_center']))
+
+    def chunks(self, episode, generator, rules):
+        """Stream the chunks of an episode.
+
+        Once the library runs out of chunks for the episode, the rest are
+        generated from the episode's seed, carrying on where the library
+        left off.
+
+        :param episode: The number of the episode, counting from 0.
+        :param generator: The terrain_gen.ChunkGenerator for the chunks past the end.
+        :param rules: The terrain_gen.SpawnRules for the chunks past the end.
+        :return: An endless generator of terrain_gen.Chunks.
+        """
+        if (generator.columns, generator.rows) != (self.columns, self.rows):
+            raise ValueError("%s has %dx%d chunks, expected %dx%d" % (
+                self.path, self.columns, self.rows, generator.columns, generator.rows))
+        for index in range(1, self.chunks_per_episode + 1):
+            yield self.chunk(episode, index)
+        last = self.chunk(episode, self.chunks_per_episode)
+        yield from generator.chunks(self.seed(episode), last.tiles, rules,
+                                    self.chunks_per_episode, last.carving_center)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect a library of pre-generated terrain chunks.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="generate a chunk library")
+    build.add_argument('path', help="file to write")
+    build.add_argument('--episodes', type=int, default=100, help="number of episodes (default: 100)")
+    build.add_argument('--chunks', type=int, default=50, help="chunks per episode (default: 50)")
+    build.add_argument('--seed', type=int, default=0,
+                       help="terrain seed of the first episode, episode n uses seed + n (default: 0)")
+    build.add_argument('--columns', type=int, default=30, help="chunk width in tiles (default: 30)")
+    build.add_argument('--rows', type=int, default=30, help="chunk height in tiles (default: 30)")
+
+    info = commands.add_parser('info', help="describe a chunk library")
+    info.add_argument('path', help="file to read")
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        start = time.perf_counter()
+        write_library(args.path,
+                      terrain_gen.ChunkGenerator(args.columns, args.rows),
+                      range(args.seed, args.seed + args.episodes),
+                      args.chunks)
+        print("wrote %d episodes of %d chunks to %s in %.1fs" % (
+            args.episodes, args.chunks, args.path, time.perf_counter() - start))
+    else:
+        library = ChunkLibrary(args.path)
+        print("%s: %d episodes of %d chunks, %dx%d tiles, up to %d spawns per chunk" % (
+            library.path, library.episodes, library.chunks_per_episode,
+            library.columns, library.rows, library.max_spawns))
+        if library.episodes:
+            print("seeds %d to %d" % (library.seed(0), library.seed(library.episodes - 1)))
+
+
+if __name__ == '__main__':
+    main()
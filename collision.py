@@ -0,0 +1,264 @@
+"""Collision checks between entities, in tile space.
+
+Everything here works on boxes of whole tiles: a box at (x, y) that is
+width by height tiles covers columns x to x + width - 1 and rows y to
+y + height - 1. Nothing here needs pygame.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+
+class SpatialHash:
+    """A uniform grid with one cell per tile, holding the keys of the boxes
+    that cover each tile.
+
+    Boxes are whole tiles, so two boxes overlap exactly when they share a
+    tile, and a query needs no further overlap test. The grid does not
+    track movement; rebuild it whenever the boxes move.
+    """
+    def __init__(self):
+        self.cells = defaultdict(list)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.cells.clear()
+        self.count = 0
+
+    def insert(self, key, x, y, width=1, height=1):
+        """Add a box to the grid.
+
+        :param key: What the box belongs to, usually an entity id.
+        :param x: First column of the box.
+        :param y: First row of the box.
+        :param width: Width of the box, in tiles.
+        :param height: Height of the box, in tiles.
+        """
+        cells = self.cells
+        for column in range(x, x + width):
+            for row in range(y, y + height):
+                cells[(column, row)].append(key)
+        self.count += 1
+
+    def rebuild(self, boxes):
+        """Replace everything in the grid.
+
+        :param boxes: An iterable of (key, x, y, width, height) tuples.
+        """
+        self.clear()
+        for box in boxes:
+            self.insert(*box)
+
+    def query(self, x, y, width=1, height=1):
+        """Get the keys of the boxes that overlap a box.
+
+        :return: A list with each key once. Keys in the same tile come in
+        the order they were inserted.
+        """
+        cells = self.cells
+        if width == 1 and height == 1:
+            # a single tile, which is what bullets and the player take up
+            return list(cells.get((x, y), ()))
+        found = {}
+        for column in range(x, x + width):
+            for row in range(y, y + height):
+                for key in cells.get((column, row), ()):
+                    found[key] = True
+        return list(found)
+
+
+def overlaps(x1, y1, width1, height1, x2, y2, width2, height2):
+    """Check if two boxes overlap.
+
+    Works on plain ints, so nothing is allocated for a test.
+    """
+    return x1 < x2 + width2 and x2 < x1 + width1 and y1 < y2 + height2 and y2 < y1 + height1
+
+
+def overlaps_many(x, y, width, height, xs, ys, widths, heights):
+    """Check one box against many boxes at once.
+
+    :param xs: numpy array of the first columns of the boxes.
+    :param ys: numpy array of their first rows.
+    :param widths: numpy array of their widths, or one width for all of them.
+    :param heights: numpy array of their heights, or one height for all of them.
+    :return: A bool array, True for every box that overlaps the first one.
+    """
+    return (x < xs + widths) & (xs < x + width) & (y < ys + heights) & (ys < y + height)
+
+
+def traverse(x0, y0, x1, y1):
+    """Get the tiles a straight line passes through, in order, by stepping
+    from one tile edge to the next (DDA).
+
+    The line runs from the centre of tile (x0, y0) to the centre of tile
+    (x1, y1). Where it passes exactly through a corner of four tiles, it
+    steps diagonally, without visiting the two tiles beside the corner.
+
+    :return: A list of (x, y) tuples, from (x0, y0) to (x1, y1).
+    """
+    dx = abs(x1 - x0)
+    dy = abs(y1 - y0)
+    step_x = 1 if x1 > x0 else -1
+    step_y = 1 if y1 > y0 else -1
+    x, y = x0, y0
+    tiles = [(x, y)]
+    # The line crosses its i-th column edge at (2i + 1) / 2dx of the way, and its
+    # j-th row edge at (2j + 1) / 2dy. They are compared multiplied by 2dx * dy,
+    # so that corners are found exactly
+    i = j = 0
+    while i < dx or j < dy:
+        cross_x = (2 * i + 1) * dy
+        cross_y = (2 * j + 1) * dx
+        if j == dy or (i < dx and cross_x < cross_y):
+            x += step_x
+            i += 1
+        elif i == dx or cross_y < cross_x:
+            y += step_y
+            j += 1
+        else:
+            x += step_x
+            y += step_y
+            i += 1
+            j += 1
+        tiles.append((x, y))
+    return tiles
+
+
+def overlaps_path(tiles, x, y, width, height):
+    """Get the index of the first tile of a path that is in a box, or -1.
+
+    :param tiles: A list of (x, y) tuples, see traverse.
+    """
+    for i, (tile_x, tile_y) in enumerate(tiles):
+        if x <= tile_x < x + width and y <= tile_y < y + height:
+            return i
+    return -1
+
+
+def path_steps(start_xs, start_ys, xs, ys):
+    """Get the tiles that many moves pass through, a step at a time, all at once.
+
+    The tiles after the start of each move are the same as traverse finds
+    for moves that are horizontal, vertical or diagonal. A move that does
+    not go anywhere covers the one tile it is on.
+
+    :param start_xs: numpy int array of the columns each move starts from.
+    :param start_ys: numpy int array of the rows each move starts from.
+    :param xs: numpy int array of the columns each move ends on.
+    :param ys: numpy int array of the rows each move ends on.
+    :return: (step_xs, step_ys, valid) arrays, with a row for every step and a
+    column for every move. Row k holds the tile each move is on after k + 1
+    steps; valid is False for the steps past the end of a move.
+    """
+    dx = xs - start_xs
+    dy = ys - start_ys
+    steps = np.maximum(np.abs(dx), np.abs(dy))
+    k = np.arange(1, max(int(steps.max(initial=0)), 1) + 1)[:, None]
+    step_xs = start_xs + np.sign(dx) * np.minimum(k, np.abs(dx))
+    step_ys = start_ys + np.sign(dy) * np.minimum(k, np.abs(dy))
+    valid = k <= np.maximum(steps, 1)
+    return step_xs, step_ys, valid
+
+
+def first_hits(xs, ys, boxes):
+    """Find the first box that each of many single tiles is in, all at once.
+
+    :param xs: numpy array of the columns of the tiles, e.g. bullets.
+    :param ys: numpy array of their rows.
+    :param boxes: A (xs, ys, widths, heights) tuple of numpy arrays.
+    :return: An int array with the index of the first box each tile is in, or -1.
+    """
+    box_xs, box_ys, widths, heights = boxes
+    if len(box_xs) == 0:
+        return np.full(len(xs), -1)
+    # one row per tile, one column per box
+    xs = np.asarray(xs)[:, None]
+    ys = np.asarray(ys)[:, None]
+    inside = (xs >= box_xs) & (xs < box_xs + widths) & (ys >= box_ys) & (ys < box_ys + heights)
+    return np.where(inside.any(axis=1), inside.argmax(axis=1), -1)
+
+
+def paths_overlap(start_xs, start_ys, xs, ys, x, y, width, height):
+    """Check which of many moves pass through a box, all at once.
+
+    The batched form of overlaps_path, with the paths made by path_steps.
+
+    :return: A bool array, True for every move that has a step in the box.
+    """
+    step_xs, step_ys, valid = path_steps(start_xs, start_ys, xs, ys)
+    box = (np.array([x]), np.array([y]), np.array([width]), np.array([height]))
+    inside = (first_hits(step_xs.ravel(), step_ys.ravel(), box) >= 0).reshape(step_xs.shape)
+    return (inside & valid).any(axis=0)
+
+
+def land_hits(xs, ys, land):
+    """Check which of many single tiles are land, all at once.
+
+    :param land: A (columns, rows) bool array, True for land. Tiles outside it are not land.
+    :return: A bool array, True for every tile on land.
+    """
+    xs = np.asarray(xs)
+    ys = np.asarray(ys)
+    columns, rows = land.shape
+    inside = (xs >= 0) & (xs < columns) & (ys >= 0) & (ys < rows)
+    hits = np.zeros(len(xs), dtype=bool)
+    hits[inside] = land[xs[inside], ys[inside]]
+    return hits
+
+
+class CollisionEvents:
+    """The collisions found in one frame, and the handlers that act on them.
+
+    A collision is a kind, which is up to the caller, and the two things
+    that collided; the second is None for collisions with the terrain.
+    Handlers are called with the two things, in the order the collisions
+    were emitted.
+    """
+    def __init__(self):
+        self.events = []
+        self.handlers = defaultdict(list)
+        # things that are gone for the rest of the frame
+        self.gone = set()
+
+    def __len__(self):
+        return len(self.events)
+
+    def subscribe(self, kind, handler):
+        """Call handler(first, second) for every collision of this kind."""
+        self.handlers[kind].append(handler)
+
+    def emit(self, kind, first, second=None):
+        self.events.append((kind, first, second))
+
+    def discard(self, key):
+        """Drop every collision something is part of, for the rest of the frame.
+
+        Use it when a handler removes something, so that it is not removed,
+        or scored, twice.
+        """
+        self.gone.add(key)
+
+    def dispatch(self):
+        """Hand every collision to the handlers of its kind, then empty the buffer.
+
+        A handler can call clear to drop the collisions that are still to come.
+        """
+        events = self.events
+        gone = self.gone
+        i = 0
+        while i < len(events):
+            kind, first, second = events[i]
+            i += 1
+            for handler in self.handlers.get(kind, ()):
+                if first in gone or second in gone:
+                    break
+                handler(first, second)
+        self.clear()
+
+    def clear(self):
+        self.events.clear()
+        self.gone.clear()
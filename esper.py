@@ -1,6 +1,25 @@
+import csv as _csv
+import json as _json
+import threading as _threading
 import time as _time
 
-from functools import lru_cache as _lru_cache
+from collections import deque as _deque
+from collections import namedtuple as _namedtuple
+from collections import OrderedDict as _OrderedDict
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+
+# Entity IDs pack a recycled index into the low bits, and the generation
+# of that index into the high bits.
+_INDEX_BITS = 32
+_INDEX_MASK = (1 << _INDEX_BITS) - 1
+
+CacheInfo = _namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
 
 
 class Processor:
@@ -12,53 +31,549 @@ class Processor:
     generally want to iterate over entities with one (or more) calls to the
     appropriate world methods there, such as
     `for ent, (rend, vel) in self.world.get_components(Renderable, Velocity):`
+
+    A Processor can run less often than every call to `World.process` by
+    setting its `interval`, in ticks. It then runs on every tick where
+    `tick % interval == phase`, so all Processors share the World's clock.
+
+    A Processor can also declare the Component types that it `reads` and
+    `writes`, where creating or deleting Entities counts as writing all of
+    their Component types. In a parallel World, Processors whose
+    declarations do not overlap may run at the same time. A value of None
+    means "anything", so undeclared Processors always run on their own.
     """
     world = None
+    interval = 1
+    phase = 0
+    reads = None
+    writes = None
 
     def process(self, *args, **kwargs):
         raise NotImplementedError
 
 
+class _Archetype:
+    """A table of all Entities that share the exact same Component types.
+
+    Every Component type in the signature has its own column, and the
+    columns are kept in step with the `entities` list, so that row *n* of
+    each column belongs to `entities[n]`. Rows are removed by swapping the
+    last row into the hole, which keeps the columns contiguous.
+    """
+    __slots__ = ('signature', 'entities', 'columns', 'rows')
+
+    def __init__(self, signature):
+        self.signature = signature
+        self.entities = []
+        self.columns = {component_type: [] for component_type in signature}
+        self.rows = {}
+
+    def append(self, entity, components):
+        self.rows[entity] = len(self.entities)
+        self.entities.append(entity)
+        for component_type, column in self.columns.items():
+            column.append(components[component_type])
+
+    def remove(self, entity):
+        row = self.rows.pop(entity)
+        last_entity = self.entities.pop()
+
+        if last_entity == entity:
+            for column in self.columns.values():
+                column.pop()
+        else:
+            self.entities[row] = last_entity
+            self.rows[last_entity] = row
+            for column in self.columns.values():
+                column[row] = column.pop()
+
+
+class ProcessorTimings:
+    """Execution time statistics for one Processor.
+
+    The most recent *window* samples are kept, in nanoseconds, and are
+    used for the percentiles and the maximum. The call count and the total
+    time cover every call since the statistics were last reset.
+    """
+    def __init__(self, window=1000):
+        self.samples = _deque(maxlen=window)
+        self.calls = 0
+        self.total_ns = 0
+
+    def add(self, elapsed_ns):
+        self.samples.append(elapsed_ns)
+        self.calls += 1
+        self.total_ns += elapsed_ns
+
+    def percentile(self, percent):
+        """Get a percentile of the recent samples, in nanoseconds.
+
+        Uses the nearest-rank method. Returns 0 if there are no samples.
+        :param percent: The percentile to get, from 0 to 100.
+        """
+        if not self.samples:
+            return 0
+        ordered = sorted(self.samples)
+        rank = max(int(-(-percent * len(ordered) // 100)), 1)
+        return ordered[rank - 1]
+
+    def summary(self):
+        """Get the statistics as a dict, with times in milliseconds."""
+        return {
+            'calls': self.calls,
+            'mean_ms': self.total_ns / self.calls / 1e6 if self.calls else 0.0,
+            'p50_ms': self.percentile(50) / 1e6,
+            'p95_ms': self.percentile(95) / 1e6,
+            'p99_ms': self.percentile(99) / 1e6,
+            'max_ms': max(self.samples, default=0) / 1e6,
+        }
+
+
+def _conflicts(first, second):
+    """Check if two Processors may touch the same Component types."""
+    if None in (first.reads, first.writes, second.reads, second.writes):
+        return True
+    first_writes = set(first.writes)
+    second_writes = set(second.writes)
+    return bool(first_writes.intersection(second.reads) or first_writes & second_writes or
+                second_writes.intersection(first.reads))
+
+
+def _array_field(store_field):
+    """Build a property that proxies one field of an ArrayStore row."""
+    def fget(self):
+        return self._store.columns[store_field][self._row].item()
+
+    def fset(self, value):
+        column = self._store.columns[store_field]
+        _check_exact(column, store_field, value)
+        column[self._row] = value
+
+    return property(fget, fset)
+
+
+def _check_exact(column, field, value):
+    """Raise a ValueError if an integer column would truncate a value."""
+    if column.dtype.kind in 'iu' and value != int(value):
+        raise ValueError("{} = {!r} does not fit the {} column".format(field, value, column.dtype))
+
+
+class ArrayStore:
+    """Dense NumPy columns for the numeric fields of one Component type.
+
+    Every Entity with a Component of this type owns one row, and each of
+    the registered fields is stored in its own column. The Component
+    instances themselves are turned into lightweight views, whose field
+    attributes read and write their row, so existing object-style code such
+    as `pos.x += 1` keeps working. Processors can instead operate on a whole
+    column at once, for example `positions.field('y')[:] += 1`.
+
+    Rows are removed by swapping the last row into the hole, so row numbers
+    are not stable between structural changes. When a Component is removed,
+    its instance is turned back into a plain object holding its last values.
+
+    Setting a field of an integer column to a value with a fractional part
+    raises a ValueError instead of truncating it. Writes to the columns
+    themselves follow NumPy's casting rules.
+    """
+
+    def __init__(self, component_type, fields, dtype='int64', capacity=64):
+        if _np is None:
+            raise ImportError("numpy is required for array-backed Components")
+        self.component_type = component_type
+        self.fields = tuple(fields)
+        self.count = 0
+        self.rows = {}
+        self.instances = []
+        self.entities = _np.zeros(capacity, dtype='int64')
+        self.columns = {field: _np.zeros(capacity, dtype=dtype) for field in self.fields}
+        namespace = {field: _array_field(field) for field in self.fields}
+        namespace['_array_component'] = component_type
+        self.view_type = type(component_type.__name__, (component_type,), namespace)
+
+    def field(self, name):
+        """Get a writable NumPy view of the live rows of one column.
+
+        The returned array is only valid until the next structural change
+        (a Component of this type being added or removed).
+
+        :param name: The name of the field.
+        :return: A one dimensional NumPy array, one element per row.
+        """
+        return self.columns[name][:self.count]
+
+    def ids(self):
+        """Get a NumPy view of the Entity IDs, in row order."""
+        return self.entities[:self.count]
+
+    def rows_for(self, entities):
+        """Get the row numbers of several Entities, as a NumPy array.
+
+        :param entities: An iterable of Entity IDs that have this Component.
+        :return: A NumPy integer array of row numbers, in the same order.
+        """
+        rows = self.rows
+        return _np.fromiter((rows[entity] for entity in entities), dtype='intp')
+
+    def _grow(self):
+        capacity = len(self.entities) * 2
+        for name, column in self.columns.items():
+            grown = _np.zeros(capacity, dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            self.columns[name] = grown
+        grown = _np.zeros(capacity, dtype='int64')
+        grown[:self.count] = self.entities[:self.count]
+        self.entities = grown
+
+    def attach(self, entity, instance):
+        """Store a Component instance's fields in a row, and make it a view.
+
+        If the Entity already owns a row, the previous instance is detached
+        and the row is reused.
+        """
+        self.check(instance)
+        values = [getattr(instance, field) for field in self.fields]
+        row = self.rows.get(entity)
+        if row is None:
+            if self.count == len(self.entities):
+                self._grow()
+            row = self.count
+            self.count += 1
+            self.rows[entity] = row
+            self.entities[row] = entity
+            self.instances.append(instance)
+        else:
+            self._restore(self.instances[row])
+            self.instances[row] = instance
+
+        for field, value in zip(self.fields, values):
+            self.columns[field][row] = value
+            instance.__dict__.pop(field, None)
+        instance._store = self
+        instance._row = row
+        instance.__class__ = self.view_type
+
+    def check(self, instance):
+        """Raise a ValueError if a Component instance has a field its column would truncate."""
+        for field in self.fields:
+            _check_exact(self.columns[field], field, getattr(instance, field))
+
+    def detach(self, entity):
+        """Release an Entity's row, and turn its instance back into a plain object."""
+        row = self.rows.pop(entity)
+        instance = self.instances[row]
+        self._restore(instance)
+
+        last = self.count - 1
+        if row != last:
+            moved = self.instances[last]
+            self.instances[row] = moved
+            moved._row = row
+            moved_entity = self.entities[last]
+            self.entities[row] = moved_entity
+            self.rows[int(moved_entity)] = row
+            for column in self.columns.values():
+                column[row] = column[last]
+        self.instances.pop()
+        self.count = last
+
+    def clear(self):
+        """Detach every row."""
+        for instance in self.instances:
+            self._restore(instance)
+        self.instances.clear()
+        self.rows.clear()
+        self.count = 0
+
+    def _restore(self, instance):
+        values = [getattr(instance, field) for field in self.fields]
+        instance.__class__ = self.component_type
+        del instance._store, instance._row
+        for field, value in zip(self.fields, values):
+            setattr(instance, field, value)
+
+
+class CommandBuffer:
+    """Records structural changes to a World, to be applied later in a batch.
+
+    Processors can record Entity creation and deletion, and Component
+    addition and removal, while they iterate over query results. Nothing
+    changes until `flush` is called, which applies every command in the
+    order it was recorded, and then invalidates the query cache once.
+    Every World has a buffer at `World.commands`, which is flushed at the
+    end of each call to `World.process`. Recording is thread safe.
+
+    Commands that refer to an Entity which no longer exists, or removals
+    of Components that the Entity no longer has, are skipped.
+    """
+    _CREATE, _DELETE, _ADD, _REMOVE = range(4)
+
+    def __init__(self, world):
+        self.world = world
+        self._commands = []
+        self._lock = _threading.Lock()
+
+    def __len__(self):
+        return len(self._commands)
+
+    def create_entity(self, *components):
+        """Record the creation of an Entity.
+
+        The Entity ID is reserved immediately, so it can be used in later
+        commands, but its Components are only added when the buffer is
+        flushed.
+
+        :param components: Optional Component instances for the Entity.
+        :return: The new Entity ID.
+        """
+        with self._lock:
+            entity = self.world._new_entity_id()
+            self._commands.append((self._CREATE, entity, components))
+        return entity
+
+    def create_entities(self, component_sets):
+        """Record the creation of many Entities.
+
+        :param component_sets: An iterable of Component instance sequences.
+        :return: A list of the new Entity IDs, in the same order.
+        """
+        return [self.create_entity(*components) for components in component_sets]
+
+    def delete_entity(self, entity):
+        """Record the deletion of an Entity and all of its Components."""
+        with self._lock:
+            self._commands.append((self._DELETE, entity, None))
+
+    def add_component(self, entity, component_instance):
+        """Record the addition of a Component instance to an Entity."""
+        with self._lock:
+            self._commands.append((self._ADD, entity, component_instance))
+
+    def remove_component(self, entity, component_type):
+        """Record the removal of a Component from an Entity, by type."""
+        with self._lock:
+            self._commands.append((self._REMOVE, entity, component_type))
+
+    def clear(self):
+        """Discard all recorded commands without applying them."""
+        with self._lock:
+            self._commands.clear()
+
+    def flush(self):
+        """Apply all recorded commands to the World, in order."""
+        with self._lock:
+            commands, self._commands = self._commands, []
+        if not commands:
+            return
+
+        world = self.world
+        changed_types = set()
+        for command, entity, argument in commands:
+            if not world.entity_exists(entity):
+                continue
+            if command == self._CREATE:
+                if argument:
+                    changed_types.update(world._insert_entity(entity, argument))
+            elif command == self._DELETE:
+                changed_types.update(world._remove_entity(entity))
+            elif command == self._ADD:
+                changed_types.add(world._add_component(entity, argument))
+            elif argument in world._entities.get(entity, ()):
+                world._remove_component(entity, argument)
+                changed_types.add(argument)
+
+        world._invalidate(changed_types)
+
+
 class World:
-    def __init__(self, timed=False):
+    def __init__(self, timed=False, archetypes=False, cache_size=128, timing_window=1000,
+                 parallel=False, max_workers=None):
         """A World object keeps track of all Entities, Components, and Processors.
 
         A World contains a database of all Entity/Component assignments. It also
         handles calling the process method on any Processors assigned to it.
+
+        :param timed: If True, track Processor execution times. See
+        `timing_report` and `export_timings`.
+        :param archetypes: If True, additionally store Entities in archetype
+        tables (one table per unique set of Component types), so that
+        multi-Component queries scan the matching tables instead of
+        intersecting sets of Entities.
+        :param cache_size: The maximum number of query results to cache for
+        this World. The least recently used result is discarded first.
+        Pass None for an unbounded cache.
+        :param timing_window: When timed, the number of recent calls per
+        Processor that the percentiles are computed from.
+        :param parallel: If True, Processors whose declared `reads` and
+        `writes` do not overlap run concurrently on a thread pool. Leave
+        False for the deterministic, serial priority order. Processors that
+        run concurrently must not create, delete, add or remove anything
+        immediately; deferred deletion and `World.commands` are safe.
+        :param max_workers: The size of the thread pool, when parallel.
         """
         self._processors = []
+        self._tick = 0
         self._next_entity_id = 0
+        self._generations = [0]
+        self._free_indices = []
         self._components = {}
         self._entities = {}
         self._dead_entities = set()
+        self.commands = CommandBuffer(self)
+        self._component_versions = {}
+        self._query_cache = _OrderedDict()
+        self._cache_lock = _threading.Lock()
+        self._cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._archetypes = None
+        self._array_stores = {}
+        self._timed = timed
         if timed:
             self.process_times = {}
+            self.processor_timings = {}
+            self._timing_window = timing_window
             self._process = self._timed_process
+        self._executor = None
+        self._stages = {}
+        if parallel:
+            self._executor = _ThreadPoolExecutor(max_workers, thread_name_prefix='esper')
+            self._process = self._parallel_process
+        if archetypes:
+            self._archetypes = {}
+            self._archetypes_by_type = {}
+            self._entity_archetype = {}
+            self._get_component = self._archetype_get_component
+            self._get_components = self._archetype_get_components
 
     def clear_cache(self):
-        self.get_component.cache_clear()
-        self.get_components.cache_clear()
+        """Discard every cached query result."""
+        self._query_cache.clear()
+
+    def cache_info(self):
+        """Report the query cache statistics for this World.
+
+        :return: A CacheInfo named tuple of (hits, misses, maxsize, currsize),
+        in the same form as `functools.lru_cache`.
+        """
+        return CacheInfo(self.cache_hits, self.cache_misses, self._cache_size, len(self._query_cache))
+
+    def _cache_lookup(self, key, version):
+        """Return a cached query result, or None if it is missing or stale."""
+        with self._cache_lock:
+            cached = self._query_cache.get(key)
+            if cached is not None and cached[0] == version:
+                self._query_cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached[1]
+            self.cache_misses += 1
+            return None
+
+    def _cache_store(self, key, version, result):
+        """Cache a query result, evicting the least recently used if full."""
+        with self._cache_lock:
+            cache = self._query_cache
+            cache[key] = (version, result)
+            cache.move_to_end(key)
+            if self._cache_size is not None and len(cache) > self._cache_size:
+                cache.popitem(last=False)
+
+    def _invalidate(self, component_types):
+        """Bump the version of one or more Component types.
+
+        Cached query results are tagged with the versions of the Component
+        types they were built from, so only the queries that mention one of
+        these types will be rebuilt on their next call.
+
+        :param component_types: An iterable of Component types.
+        """
+        versions = self._component_versions
+        for component_type in component_types:
+            versions[component_type] = versions.get(component_type, 0) + 1
 
     def clear_database(self):
-        """Remove all Entities and Components from the World."""
-        self._next_entity_id = 0
+        """Remove all Entities and Components from the World.
+
+        Entity IDs from before the clear stay stale: every index moves on to
+        a new generation before it is reused.
+        """
+        generations = self._generations
+        for index in range(1, len(generations)):
+            generations[index] += 1
+        # lowest indices last, so they are reused first
+        self._free_indices[:] = range(len(generations) - 1, 0, -1)
         self._dead_entities.clear()
+        self.commands.clear()
         self._components.clear()
         self._entities.clear()
+        if self._archetypes is not None:
+            self._archetypes.clear()
+            self._archetypes_by_type.clear()
+            self._entity_archetype.clear()
+        for store in self._array_stores.values():
+            store.clear()
         self.clear_cache()
 
-    def add_processor(self, processor_instance, priority=0):
+    def register_array_component(self, component_type, *fields, dtype='int64'):
+        """Store the numeric fields of a Component type in NumPy columns.
+
+        Instances of the Component type that are added to an Entity become
+        lightweight views onto an ArrayStore row. Their fields can still be
+        read and written as attributes, but Processors can also update every
+        instance at once through the store's columns. Any existing
+        Components of this type are moved into the store immediately.
+        Requires numpy.
+
+        :param component_type: The Component type to store in arrays.
+        :param fields: The names of the numeric attributes to store.
+        :param dtype: The NumPy dtype of the columns. With the default integer
+                      columns, fields can only be set to whole numbers.
+        :return: The ArrayStore for this Component type.
+        """
+        store = ArrayStore(component_type, fields, dtype=dtype)
+        self._array_stores[component_type] = store
+        for entity, instance in self._get_component(component_type):
+            store.attach(entity, instance)
+        return store
+
+    def array_store(self, component_type):
+        """Get the ArrayStore of an array-backed Component type.
+
+        Raises a KeyError if the Component type was not registered with
+        `register_array_component`.
+        :param component_type: The Component type.
+        :return: The ArrayStore holding the Component's fields.
+        """
+        return self._array_stores[component_type]
+
+    def _release_arrays(self, entity, component_types):
+        """Detach an Entity's array-backed Components from their stores."""
+        for component_type in component_types:
+            store = self._array_stores.get(component_type)
+            if store is not None:
+                store.detach(entity)
+
+    def add_processor(self, processor_instance, priority=0, interval=None, phase=None):
         """Add a Processor instance to the World.
 
         :param processor_instance: An instance of a Processor,
         subclassed from the Processor class
         :param priority: A higher number is processed first.
+        :param interval: Optionally override the Processor's `interval`,
+        the number of ticks between each of its runs.
+        :param phase: Optionally override the Processor's `phase`, the
+        tick (modulo the interval) on which it runs.
         """
         assert issubclass(processor_instance.__class__, Processor)
         processor_instance.priority = priority
+        if interval is not None:
+            processor_instance.interval = interval
+        if phase is not None:
+            processor_instance.phase = phase
         processor_instance.world = self
         self._processors.append(processor_instance)
         self._processors.sort(key=lambda proc: proc.priority, reverse=True)
+        self._stages.clear()
 
     def remove_processor(self, processor_type):
         """Remove a Processor from the World, by type.
@@ -69,6 +584,7 @@ class World:
             if type(processor) == processor_type:
                 processor.world = None
                 self._processors.remove(processor)
+                self._stages.clear()
 
     def get_processor(self, processor_type):
         """Get a Processor instance, by type.
@@ -91,18 +607,95 @@ class World:
         You can optionally pass one or more Component instances to be
         assigned to the Entity.
 
+        The indexes of deleted Entities are reused, but every reuse bumps
+        a generation counter that is part of the ID, so an ID kept after its
+        Entity was deleted will never refer to a different Entity.
+
         :param components: Optional components to be assigned to the
         entity on creation.
-        :return: The next Entity ID in sequence.
+        :return: A new Entity ID.
+        """
+        entity = self._new_entity_id()
+
+        if components:
+            self._invalidate(self._insert_entity(entity, components))
+
+        return entity
+
+    def create_entities(self, component_sets):
+        """Create many new Entities in one batch.
+
+        Each item of *component_sets* is a sequence of Component instances
+        for one new Entity, just like the arguments of `create_entity`. All of
+        the Entities are indexed in one pass, and the query cache is only
+        invalidated once for the whole batch.
+
+        :param component_sets: An iterable of Component instance sequences.
+        :return: A list of the new Entity IDs, in the same order.
         """
-        self._next_entity_id += 1
+        entities = []
+        created_types = set()
+        for components in component_sets:
+            entity = self._new_entity_id()
+            if components:
+                created_types.update(self._insert_entity(entity, components))
+            entities.append(entity)
+
+        self._invalidate(created_types)
+        return entities
+
+    def _new_entity_id(self):
+        """Take an index from the free list, or a new one, and tag it."""
+        if self._free_indices:
+            index = self._free_indices.pop()
+        else:
+            self._next_entity_id += 1
+            index = self._next_entity_id
+            self._generations.append(0)
+        return (self._generations[index] << _INDEX_BITS) | index
+
+    def entity_exists(self, entity):
+        """Check if an Entity ID refers to a live Entity.
+
+        :param entity: The Entity ID to check.
+        :return: True if the Entity has not been deleted, otherwise False.
+        """
+        index = entity & _INDEX_MASK
+        return 0 < index < len(self._generations) and self._generations[index] == entity >> _INDEX_BITS
+
+    def _insert_entity(self, entity, components):
+        """Index the Components of a new Entity, without touching the cache.
+
+        :param entity: The new Entity ID.
+        :param components: A non-empty sequence of Component instances.
+        :return: The Entity's dict of Component type to Component instance.
+        """
+        # nothing is indexed if a Component does not fit its columns
+        for component_instance in components:
+            component_type = getattr(component_instance, '_array_component', None) or type(component_instance)
+            store = self._array_stores.get(component_type)
+            if store is not None:
+                store.check(component_instance)
+
+        entity_components = self._entities[entity] = {}
+
+        for component_instance in components:
+            component_type = getattr(component_instance, '_array_component', None) or type(component_instance)
 
-        # TODO: duplicate add_component code here for performance
-        for component in components:
-            self.add_component(self._next_entity_id, component)
+            if component_type not in self._components:
+                self._components[component_type] = set()
 
-        # self.clear_cache()
-        return self._next_entity_id
+            self._components[component_type].add(entity)
+
+            store = self._array_stores.get(component_type)
+            if store is not None:
+                store.attach(entity, component_instance)
+
+            entity_components[component_type] = component_instance
+
+        if self._archetypes is not None:
+            self._relocate(entity)
+        return entity_components
 
     def delete_entity(self, entity, immediate=False):
         """Delete an Entity from the World.
@@ -118,17 +711,56 @@ class World:
         :param immediate: If True, delete the Entity immediately.
         """
         if immediate:
-            for component_type in self._entities[entity]:
-                self._components[component_type].discard(entity)
+            self._invalidate(self._remove_entity(entity))
+        else:
+            self._dead_entities.add(entity)
 
-                if not self._components[component_type]:
-                    del self._components[component_type]
+    def delete_entities(self, entities, immediate=False):
+        """Delete many Entities from the World in one batch.
 
-            del self._entities[entity]
-            self.clear_cache()
+        This behaves like calling `delete_entity` for each Entity, except
+        that with immediate deletion the query cache is only invalidated
+        once for the whole batch.
 
+        Raises a KeyError if any of the given entities do not exist.
+        :param entities: An iterable of the Entity IDs to delete.
+        :param immediate: If True, delete the Entities immediately.
+        """
+        if immediate:
+            deleted_types = set()
+            for entity in entities:
+                deleted_types.update(self._remove_entity(entity))
+            self._invalidate(deleted_types)
         else:
-            self._dead_entities.add(entity)
+            self._dead_entities.update(entities)
+
+    def _remove_entity(self, entity):
+        """Remove an Entity and its Components, without touching the cache.
+
+        :param entity: The Entity ID to remove.
+        :return: The removed Entity's dict of Component type to instance.
+        """
+        if not self.entity_exists(entity):
+            raise KeyError(entity)
+
+        for component_type in self._entities.get(entity, ()):
+            self._components[component_type].discard(entity)
+
+            if not self._components[component_type]:
+                del self._components[component_type]
+
+        components = self._entities.pop(entity, {})
+        if self._array_stores:
+            self._release_arrays(entity, components)
+        if self._archetypes is not None and components:
+            self._entity_archetype.pop(entity).remove(entity)
+        # it may also have been marked for deletion earlier in the frame
+        self._dead_entities.discard(entity)
+
+        index = entity & _INDEX_MASK
+        self._generations[index] += 1
+        self._free_indices.append(index)
+        return components
 
     def component_for_entity(self, entity, component_type):
         """Retrieve a Component instance for a specific Entity.
@@ -179,7 +811,18 @@ class World:
         :param entity: The Entity to associate the Component with.
         :param component_instance: A Component instance.
         """
-        component_type = type(component_instance)
+        self._invalidate((self._add_component(entity, component_instance),))
+
+    def _add_component(self, entity, component_instance):
+        """Add a Component instance to an Entity, without touching the cache.
+
+        :return: The Component type that was added.
+        """
+        component_type = getattr(component_instance, '_array_component', None) or type(component_instance)
+
+        store = self._array_stores.get(component_type)
+        if store is not None:
+            store.attach(entity, component_instance)
 
         if component_type not in self._components:
             self._components[component_type] = set()
@@ -190,7 +833,9 @@ class World:
             self._entities[entity] = {}
 
         self._entities[entity][component_type] = component_instance
-        self.clear_cache()
+        if self._archetypes is not None:
+            self._relocate(entity)
+        return component_type
 
     def remove_component(self, entity, component_type):
         """Remove a Component instance from an Entity, by type.
@@ -204,18 +849,55 @@ class World:
         :param entity: The Entity to remove the Component from.
         :param component_type: The type of the Component to remove.
         """
+        self._remove_component(entity, component_type)
+        self._invalidate((component_type,))
+        return entity
+
+    def _remove_component(self, entity, component_type):
+        """Remove a Component from an Entity, without touching the cache."""
         self._components[component_type].discard(entity)
 
         if not self._components[component_type]:
             del self._components[component_type]
 
+        if component_type in self._array_stores:
+            self._array_stores[component_type].detach(entity)
+
         del self._entities[entity][component_type]
 
         if not self._entities[entity]:
             del self._entities[entity]
 
-        self.clear_cache()
-        return entity
+        if self._archetypes is not None:
+            self._relocate(entity)
+
+    def _relocate(self, entity):
+        """Move an Entity into the archetype table matching its Components.
+
+        The Entity is removed from its current table (if any), and appended
+        to the table for its current set of Component types. Tables are
+        created on demand, and are never removed, since the same signatures
+        tend to be reused for the life of a World.
+
+        :param entity: The Entity to move.
+        """
+        archetype = self._entity_archetype.pop(entity, None)
+        if archetype is not None:
+            archetype.remove(entity)
+
+        components = self._entities.get(entity)
+        if not components:
+            return
+
+        signature = frozenset(components)
+        archetype = self._archetypes.get(signature)
+        if archetype is None:
+            archetype = self._archetypes[signature] = _Archetype(signature)
+            for component_type in signature:
+                self._archetypes_by_type.setdefault(component_type, []).append(archetype)
+
+        archetype.append(entity, components)
+        self._entity_archetype[entity] = archetype
 
     def _get_component(self, component_type):
         """Get an iterator for Entity, Component pairs.
@@ -244,13 +926,70 @@ class World:
         except KeyError:
             pass
 
-    @_lru_cache()
+    def _archetype_get_component(self, component_type):
+        """Archetype version of `_get_component`.
+
+        :param component_type: The Component type to retrieve.
+        :return: An iterator for (Entity, Component) tuples.
+        """
+        for archetype in self._archetypes_by_type.get(component_type, []):
+            yield from zip(archetype.entities, archetype.columns[component_type])
+
+    def _archetype_get_components(self, *component_types):
+        """Archetype version of `_get_components`.
+
+        Only the tables whose signature contains every requested Component
+        type are scanned. The shortest list of candidate tables is used as
+        the starting point.
+
+        :param component_types: Two or more Component types.
+        :return: An iterator for Entity, (Component1, Component2, etc)
+        tuples.
+        """
+        try:
+            candidates = min((self._archetypes_by_type[ct] for ct in component_types), key=len)
+        except KeyError:
+            return
+
+        for archetype in candidates:
+            if not archetype.signature.issuperset(component_types):
+                continue
+            columns = [archetype.columns[ct] for ct in component_types]
+            for entity, row in zip(archetype.entities, zip(*columns)):
+                yield entity, list(row)
+
     def get_component(self, component_type):
-        return [query for query in self._get_component(component_type)]
+        """Get a list of (Entity, Component) pairs, by Component type.
+
+        The result is cached, and is reused until an Entity gains or loses
+        a Component of this type.
+
+        :param component_type: The Component type to retrieve.
+        :return: A list of (Entity, Component) tuples.
+        """
+        version = self._component_versions.get(component_type, 0)
+        result = self._cache_lookup(component_type, version)
+        if result is None:
+            result = [query for query in self._get_component(component_type)]
+            self._cache_store(component_type, version, result)
+        return result
 
-    @_lru_cache()
     def get_components(self, *component_types):
-        return [query for query in self._get_components(*component_types)]
+        """Get a list of Entities that have all of the given Component types.
+
+        The result is cached, and is reused until an Entity gains or loses
+        a Component of one of these types.
+
+        :param component_types: Two or more Component types.
+        :return: A list of (Entity, [Component1, Component2, etc]) tuples.
+        """
+        versions = self._component_versions
+        version = tuple([versions.get(ct, 0) for ct in component_types])
+        result = self._cache_lookup(component_types, version)
+        if result is None:
+            result = [query for query in self._get_components(*component_types)]
+            self._cache_store(component_types, version, result)
+        return result
 
     def try_component(self, entity, component_type):
             """Try to get a single component type for an Entity.
@@ -269,51 +1008,161 @@ class World:
             else:
                 return None
 
+    def flush_commands(self):
+        """Apply the structural changes recorded in `World.commands` now."""
+        self.commands.flush()
+
     def _clear_dead_entities(self):
         """Finalize deletion of any Entities that are marked dead.
-        
-        In the interest of performance, this method duplicates code from the
-        `delete_entity` method. If that method is changed, those changes should
-        be duplicated here as well.
+
+        Entities that were already deleted by other means are skipped,
+        and dropped from the set along with the rest.
         """
-        for entity in self._dead_entities:
+        if self._dead_entities:
+            dead, self._dead_entities = self._dead_entities, set()
+            self.delete_entities([entity for entity in dead if self.entity_exists(entity)], immediate=True)
 
-            for component_type in self._entities[entity]:
-                self._components[component_type].discard(entity)
+    @property
+    def tick(self):
+        """The number of times `World.process` has been called."""
+        return self._tick
 
-                if not self._components[component_type]:
-                    del self._components[component_type]
+    def reset_clock(self):
+        """Restart the shared Processor clock from tick zero."""
+        self._tick = 0
 
-            del self._entities[entity]
-
-        self._dead_entities.clear()
-        self.clear_cache()
+    def _due_processors(self):
+        """Get the Processors that are scheduled to run on the current tick."""
+        tick = self._tick
+        return [processor for processor in self._processors
+                if processor.interval == 1 or tick % processor.interval == processor.phase % processor.interval]
 
     def _process(self, *args, **kwargs):
-        for processor in self._processors:
+        for processor in self._due_processors():
             processor.process(*args, **kwargs)
 
     def _timed_process(self, *args, **kwargs):
-        """Track Processor execution time for benchmarking."""
-        for processor in self._processors:
-            start_time = _time.process_time()
-            processor.process(*args, **kwargs)
-            process_time = int(round((_time.process_time() - start_time) * 1000, 2))
-            self.process_times[processor.__class__.__name__] = process_time
+        """Track Processor execution time for benchmarking.
+
+        `process_times` holds the latest time of each Processor in
+        milliseconds, and `processor_timings` holds the rolling statistics.
+        """
+        for processor in self._due_processors():
+            self._timed_call(processor, *args, **kwargs)
+
+    def _timed_call(self, processor, *args, **kwargs):
+        start_time = _time.perf_counter_ns()
+        processor.process(*args, **kwargs)
+        elapsed = _time.perf_counter_ns() - start_time
+        name = processor.__class__.__name__
+        self.process_times[name] = elapsed / 1e6
+        timings = self.processor_timings.get(name)
+        if timings is None:
+            timings = self.processor_timings[name] = ProcessorTimings(self._timing_window)
+        timings.add(elapsed)
+
+    def processor_stages(self, processors=None):
+        """Group Processors into stages that can run concurrently.
+
+        Each Processor is placed in the stage after the latest stage that
+        holds a higher priority Processor it conflicts with, according to
+        their `reads` and `writes`. Stages run in order, and Processors
+        within a stage are listed in priority order.
+
+        :param processors: The Processors to group, in priority order.
+        Defaults to every Processor in the World.
+        :return: A list of stages, each of which is a list of Processors.
+        """
+        if processors is None:
+            processors = self._processors
+        key = tuple(processors)
+        stages = self._stages.get(key)
+        if stages is None:
+            levels = []
+            for index, processor in enumerate(processors):
+                level = 0
+                for earlier in range(index):
+                    if levels[earlier] >= level and _conflicts(processors[earlier], processor):
+                        level = levels[earlier] + 1
+                levels.append(level)
+            stages = [[] for _ in range(max(levels, default=-1) + 1)]
+            for processor, level in zip(processors, levels):
+                stages[level].append(processor)
+            self._stages[key] = stages
+        return stages
+
+    def _parallel_process(self, *args, **kwargs):
+        """Run each stage of due Processors concurrently on the thread pool."""
+        call = self._timed_call if self._timed else self._call
+        for stage in self.processor_stages(self._due_processors()):
+            if len(stage) == 1:
+                call(stage[0], *args, **kwargs)
+                continue
+            futures = [self._executor.submit(call, processor, *args, **kwargs) for processor in stage]
+            # wait for the whole stage, then raise the first error by priority
+            for future in futures:
+                future.exception()
+            for future in futures:
+                future.result()
+
+    @staticmethod
+    def _call(processor, *args, **kwargs):
+        processor.process(*args, **kwargs)
+
+    def timing_report(self):
+        """Summarize the execution time of each Processor.
+
+        Only available if the World was created with `timed=True`.
+        :return: A dict of Processor class name to a dict of calls, mean_ms,
+        p50_ms, p95_ms, p99_ms and max_ms.
+        """
+        return {name: timings.summary() for name, timings in self.processor_timings.items()}
+
+    def reset_timings(self):
+        """Discard all Processor execution time statistics."""
+        self.process_times.clear()
+        self.processor_timings.clear()
+
+    def export_timings(self, path, file_format=None):
+        """Write the `timing_report` to a JSON or CSV file.
+
+        :param path: The file to write.
+        :param file_format: Either 'json' or 'csv'. By default, this is
+        taken from the file extension of *path*.
+        """
+        report = self.timing_report()
+        if file_format is None:
+            file_format = 'csv' if str(path).lower().endswith('.csv') else 'json'
+
+        with open(path, 'w', newline='') as out:
+            if file_format == 'json':
+                _json.dump(report, out, indent=2)
+            elif file_format == 'csv':
+                columns = ['calls', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+                writer = _csv.writer(out)
+                writer.writerow(['processor'] + columns)
+                for name, summary in report.items():
+                    writer.writerow([name] + [summary[column] for column in columns])
+            else:
+                raise ValueError("Unknown timing export format: {}".format(file_format))
 
     def process(self, *args, **kwargs):
         """Call the process method on all Processors, in order of their priority.
 
         Call the *process* method on all assigned Processors, respecting their
-        optional priority setting. In addition, any Entities that were marked
-        for deletion since the last call to *World.process*, will be deleted
-        at the start of this method call.
+        optional priority setting. Processors with an `interval` greater than
+        one are skipped on the ticks where they are not due. In addition, any
+        Entities that were marked for deletion since the last call to
+        *World.process*, will be deleted at the start of this method call,
+        and the commands recorded in `World.commands` are applied at the end.
 
         :param args: Optional arguments that will be passed through to the
         *process* method of all Processors.
         """
         self._clear_dead_entities()
         self._process(*args, **kwargs)
+        self.commands.flush()
+        self._tick += 1
 
 
 CachedWorld = World
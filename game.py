@@ -1,9 +1,14 @@
 from pygame.transform import *
 import pygame
+import argparse
 import os
 import random
+import numpy as np
 import esper
-from enum import Enum
+import terrain_gen
+import chunklib
+import collision
+from terrain_gen import Terrain, Tiles
 import socket
 import platform
 import sys
@@ -13,17 +18,31 @@ from queue import Queue
 
 pygame.init()
 
+# The size of the world can be picked at startup, e.g. for stress runs on big maps:
+#   python game.py --columns 300 --rows 300 --tile-size 3
+# Unknown options are left alone.
+parser = argparse.ArgumentParser(description="River Run")
+parser.add_argument('--columns', type=int, default=30, help="width of the screen, in tiles (default: 30)")
+parser.add_argument('--rows', type=int, default=30, help="height of the screen, in tiles (default: 30)")
+parser.add_argument('--tile-size', type=int, default=30, help="width and height of a tile, in pixels (default: 30)")
+options, _ = parser.parse_known_args()
+# the river is carved at least 5 tiles from either side, see terrain_gen.ChunkGenerator.carve
+if options.columns < 10:
+    parser.error("--columns must be at least 10")
+
 # GLOBAL CONSTANTS
 # TODO: Configuration file, maybe?
-SCREEN_WIDTH = 900
-SCREEN_HEIGHT = 900
 # Width in pixels of each tile
-TILE_WIDTH = 30
-TILE_HEIGHT = 30
+TILE_WIDTH = options.tile_size
+TILE_HEIGHT = options.tile_size
 # Number of tiles in a column.
-ROWS = SCREEN_HEIGHT // TILE_HEIGHT
+ROWS = options.rows
 # Number of tiles in a row.
-COLUMNS = SCREEN_WIDTH // TILE_WIDTH
+COLUMNS = options.columns
+SCREEN_WIDTH = COLUMNS * TILE_WIDTH
+SCREEN_HEIGHT = ROWS * TILE_HEIGHT
+# Tile size, in pixels, that the sprites in ./images are drawn for
+SPRITE_TILE_SIZE = 30
 # Player speed, in tiles per action.
 PLAYER_SPEED = 1
 # Maximum frames to process per second.
@@ -36,8 +55,8 @@ BOMB_WIDTH = 30
 BOMB_HEIGHT = 30
 # Frames to wait between scrolls, in frames
 TERRAIN_SCROLL_DELAY = 30
-PLAYER_START_POS_X = 14
-PLAYER_START_POS_Y = 27
+PLAYER_START_POS_X = COLUMNS // 2 - 1
+PLAYER_START_POS_Y = ROWS - 3
 BOAT_WIDTH = 2
 BOAT_HEIGHT = 1
 BOAT_START_VELOCITY_X = 1
@@ -46,7 +65,7 @@ JET_WIDTH = 1
 JET_HEIGHT = 1
 JET_START_VELOCITY_X = 0
 JET_START_VELOCITY_Y = 1
-BRIDGE_WIDTH = 30
+BRIDGE_WIDTH = COLUMNS
 BRIDGE_HEIGHT = 2
 FUEL_WIDTH = 1
 FUEL_HEIGHT = 2
@@ -60,6 +79,23 @@ SHIELD_PICKUP_HEIGHT = 1
 BOMB_WIDTH = 1
 BOMB_HEIGHT = 1
 GOD_MODE = False
+# Record per-system frame times, and write them to PROFILE_OUTPUT on exit
+PROFILE_SYSTEMS = False
+PROFILE_OUTPUT = "system_timings.json"
+# How many upcoming terrain chunks are generated ahead of time, on a worker thread
+PREPARED_CHUNKS = 2
+# Terrain seed for every episode (life), so that runs can be compared.
+# None picks a new seed for each episode from the global random module
+TERRAIN_SEED = None
+# How many generated terrain chunks are kept for reuse, keyed by seed and index
+CHUNK_CACHE_SIZE = 64
+# Chunk library file to replay pre-generated episodes from, see chunklib.
+# None generates the terrain as the game goes
+CHUNK_LIBRARY = None
+# Also send the AI the water spans of every on-screen row, as [start, end) pairs
+OBSERVATION_SPANS = False
+# Find the collisions of all bullets at once, with numpy, instead of one bullet at a time
+BATCHED_BULLETS = True
 
 BLACK = (0, 0, 0)
 GREY = (200, 200, 200)
@@ -72,6 +108,9 @@ ORANGE = (255, 97, 3)
 # Number of tiles to move a bullet before despawning it
 # (Effectively, a bullet's range)
 BULLET_LIFESPAN = 30
+# Tiles a bullet moves per frame. Bullets hit the first thing on the tiles they
+# pass through, so this can be raised, e.g. to run faster than real time
+BULLET_SPEED = 1
 
 SHOOT_DEFUEL_PENALTY = 1  # how much the player will be defueled when they shoot
 
@@ -141,6 +180,16 @@ def mousebuttondown():
             button.call_back()
 
 
+def load_sprite(path):
+    # sprites are drawn for SPRITE_TILE_SIZE pixel tiles, so scale them to the tile size in use
+    sprite = pygame.image.load(path)
+    if (TILE_WIDTH, TILE_HEIGHT) == (SPRITE_TILE_SIZE, SPRITE_TILE_SIZE):
+        return sprite
+    width, height = sprite.get_size()
+    return pygame.transform.scale(sprite, (width * TILE_WIDTH // SPRITE_TILE_SIZE,
+                                           height * TILE_HEIGHT // SPRITE_TILE_SIZE))
+
+
 def text_to_win(text, xpos, ypos, color, size=70):
     c = color
     font = pygame.font.SysFont('timesnewroman', size)
@@ -298,10 +347,14 @@ class Player:
                 self.__init__()
                 MODE = 1
                 print("GAME OVER")  # load title screen etc
+            # the rest of this frame's collisions are with entities that are about to go
+            collision_events.clear()
+            # apply what systems have recorded this frame, e.g. bombs being dropped,
+            # so that it is cleared with the rest instead of turning up after the reset
+            world.flush_commands()
             world.get_processor(TerrainSystem).clearTerrain()  # clear terrain
-            for ent, _ in world.get_component(Position):  # clear all enemy entities
-                if (ent != player):  # dont delete player
-                    world.delete_entity(ent, True)  # clear all enemy entities
+            # clear all enemy entities in one batch, but dont delete player
+            world.delete_entities([ent for ent, _ in world.get_component(Position) if ent != player], True)
             world.get_processor(TerrainSystem).generate_initial_terrain(
                 world.component_for_entity(terrain, Terrain))  # re-intialize terrain
             world.component_for_entity(player, Position).x = PLAYER_START_POS_X  # change player position
@@ -333,35 +386,27 @@ class RenderSystem(esper.Processor):
         super().__init__()
         self.window = window
         self.clear_color = clear_color
+        # The scaled-up terrain of the last frame, and the terrain state it was drawn from
+        self.terrain_surface = None
+        self.terrain_drawn = None
 
     def process(self):
         # Render everything . . .
         self.window.fill(self.clear_color)
         # Render the Terrain . . .
         for _, terrain in self.world.get_component(Terrain):
-            # By Column
-            for x in range(0, terrain.terrain_width):
-                # By Row
-                row = 0
-                for y in range((terrain.scroll_pos - (terrain.terrain_height // 2)), terrain.scroll_pos):
-                    # print("y -----------------------------> " + str((terrain.scroll_pos - (terrain.terrain_height // 2))) + ", " + str(terrain.scroll_pos))
-                    if (terrain.tile_matrix[x][y].tile_type == Tiles.LAND):
-                        # Land is GREEN
-                        pygame.draw.rect(self.window,
-                                         terrain.tile_matrix[x][y].color,
-                                         (x * TILE_WIDTH,
-                                          row * TILE_HEIGHT,
-                                          TILE_WIDTH,
-                                          TILE_HEIGHT))
-                    elif (terrain.tile_matrix[x][y].tile_type == Tiles.WATER):
-                        # Water is WET, err I mean BLUE
-                        pygame.draw.rect(self.window,
-                                         terrain.tile_matrix[x][y].color,
-                                         (x * TILE_WIDTH,
-                                          row * TILE_HEIGHT,
-                                          TILE_WIDTH,
-                                          TILE_HEIGHT))
-                    row += 1
+            # Land is GREEN, and water is WET, err I mean BLUE.
+            # The on-screen rows are coloured straight from the tile arrays at one
+            # pixel per tile, then scaled up to the tile size. That only happens when
+            # the terrain scrolls or changes; other frames blit the same surface again
+            drawn = (terrain.version, terrain.scroll_pos)
+            if drawn != self.terrain_drawn:
+                top = terrain.scroll_pos - (terrain.terrain_height // 2)
+                pixels = pygame.surfarray.make_surface(terrain.colors(top, terrain.scroll_pos))
+                self.terrain_surface = pygame.transform.scale(pixels, (terrain.terrain_width * TILE_WIDTH,
+                                                                       (terrain.terrain_height // 2) * TILE_HEIGHT))
+                self.terrain_drawn = drawn
+            self.window.blit(self.terrain_surface, (0, 0))
 
         # Render the Entities . . .
         for ent, (pos, render) in self.world.get_components(Position, Renderable):
@@ -396,11 +441,18 @@ class RenderSystem(esper.Processor):
                 self.window.blit(pygame.image.load("./images/shield_player.png"), ((pos.x * TILE_WIDTH) - 8, (pos.y * TILE_HEIGHT) - 7))
 
 
-        for i in range(COLUMNS):
-            pygame.draw.rect(win, (131, 135, 142), (i * TILE_WIDTH, (ROWS - 1) * TILE_WIDTH, TILE_WIDTH, TILE_HEIGHT))
+        pygame.draw.rect(win, (131, 135, 142), (0, (ROWS - 1) * TILE_HEIGHT, COLUMNS * TILE_WIDTH, TILE_HEIGHT))
 
         text_color = (221, 185, 75)
 
+        # The HUD is laid out from the bottom of the screen, with the fuel gauge in
+        # the middle: 30 pixels high, whatever the tile size, and the gauge is
+        # narrowed to fit small screens
+        hud_y = SCREEN_HEIGHT - 30
+        fuel_span = min(170, SCREEN_WIDTH // 4)
+        fuel_empt = SCREEN_WIDTH // 2 - fuel_span // 2
+        fuel_full = fuel_empt + fuel_span
+
         # Display fuel level
         p = world.component_for_entity(player, Player)
         myfont = pygame.font.SysFont("Times New Roman", 30)
@@ -410,14 +462,14 @@ class RenderSystem(esper.Processor):
         score = str(p.score)
         scoretext = scorefont.render(score, True, text_color)
         # win.blit(textsurface, (0, 0))
-        win.blit(scoretext, (570, 870))
+        win.blit(scoretext, (fuel_full + 35, hud_y))
 
         # display lives
         lives = str(p.lives)
         livesfont = pygame.font.SysFont("Times New Roman", 25)
         livesfont.set_bold(1)
         livestext = livesfont.render(lives, True, text_color)
-        win.blit(livestext, (320, 870))
+        win.blit(livestext, (fuel_empt - 45, hud_y))
 
         # display shield count
         shields = str(p.shieldsAvailable)
@@ -425,7 +477,7 @@ class RenderSystem(esper.Processor):
         livesfont.set_bold(1)
         text_color = (35, 83, 255)
         livestext = livesfont.render(shields, True, text_color)
-        win.blit(livestext, (10, 870))
+        win.blit(livestext, (10, hud_y))
 
         # drawing HUD
         font = pygame.font.SysFont('timesnewroman', 15)
@@ -434,18 +486,15 @@ class RenderSystem(esper.Processor):
         empty = font.render(text[0], True, BLACK)
         divide = font.render(text[1], True, BLACK)
         full = font.render(text[2], True, BLACK)
-        xstart = 400  # 5
-        ystart = 873  # 3
-        fuel_full = 535  # 230
-        fuel_empt = 365  # 60
+        ystart = hud_y + 3
         # assume fuel_start = 100
         location = fuel_full - (100 - p.fuel) * (fuel_full - fuel_empt) / 100
         # original box
-        pygame.draw.rect(win, WHITE, (fuel_empt - 10, ystart, 200, 25))
+        pygame.draw.rect(win, WHITE, (fuel_empt - 10, ystart, fuel_span + 30, 25))
         # fuel line
         pygame.draw.rect(win, RED, (location, ystart, 8, 25))
         # outside edge
-        pygame.draw.rect(win, BLACK, (fuel_empt - 10, ystart, 200, 25), 2)
+        pygame.draw.rect(win, BLACK, (fuel_empt - 10, ystart, fuel_span + 30, 25), 2)
         # indicator lines
         pygame.draw.rect(win, BLACK, (fuel_empt, ystart, 8, 8))
         pygame.draw.rect(win, BLACK, (fuel_full, ystart, 8, 8))
@@ -473,97 +522,181 @@ class Collider:
         return pygame.Rect(posComp.x * TILE_WIDTH, posComp.y * TILE_HEIGHT, self.width, self.height)
 
 
+# Kinds of collisions, see collision.CollisionEvents. The player, or the
+# bullet, always comes first
+PLAYER_LAND = 'player_land'
+PLAYER_ENEMY = 'player_enemy'
+PLAYER_FUEL_STRIP = 'player_fuel_strip'
+PLAYER_SHIELD_PICKUP = 'player_shield_pickup'
+BULLET_ENEMY = 'bullet_enemy'
+BULLET_FUEL_STRIP = 'bullet_fuel_strip'
+BULLET_LAND = 'bullet_land'
+ENEMY_BULLET_PLAYER = 'enemy_bullet_player'
+
+# The collisions of the current frame. Systems subscribe to the kinds they act on
+collision_events = collision.CollisionEvents()
+
+
+# the box a bullet hits a fuel strip in: the strip's own tile and the one above
+# it, whatever its collider is. Works on ints or numpy arrays
+def fuelStripTarget(x, y):
+    return x, y - 1, 1, 2
+
+
+# deletes an entity at the end of the frame, and drops the collisions it is
+# still part of, so that nothing is deleted or scored twice
+def deleteCollided(ent):
+    collision_events.discard(ent)
+    world.commands.delete_entity(ent)
+
+
+# Finds every collision of the frame in one pass, then hands them to the
+# systems subscribed to collision_events
 class ColliderSystem(esper.Processor):
     def __init__(self):
         super().__init__()
+        # Where the enemies, fuel strips and shield pickups are, by tile. Rebuilt every frame
+        self.enemies = collision.SpatialHash()
+        self.fuel_strips = collision.SpatialHash()
+        self.shield_pickups = collision.SpatialHash()
+        # Where bullets hit fuel strips, which is not their colliders, see fuelStripTarget
+        self.fuel_strip_targets = collision.SpatialHash()
+
+        collision_events.subscribe(PLAYER_LAND, self.playerHitLand)
+        collision_events.subscribe(PLAYER_ENEMY, self.playerHitEnemy)
+        collision_events.subscribe(PLAYER_FUEL_STRIP, self.playerHitFuelStrip)
+        collision_events.subscribe(PLAYER_SHIELD_PICKUP, self.playerHitShieldPickup)
 
     def process(self):
-        # check for player-land collisions
-        if (self.checkForLandCollision(world.component_for_entity(player, Position), world.component_for_entity(player, Collider))):
-            # print("player hit land")
-            if(not self.world.component_for_entity(player, Player).shielded):
-                self.world.component_for_entity(player, Player).kill()
-
-        # check for player-enemy collisions
-        if (self.checkPlayerEnemyCollisions()):
-            # print("player hit enemy")
-            if(not self.world.component_for_entity(player, Player).shielded):
-                self.world.component_for_entity(player, Player).kill()
-
-        # check for player-fuel collisions
-        if (self.checkPlayerFuelStripCollisions()):
-            # print("player refueling")
-            self.world.component_for_entity(player, Player).refuel()
-
-        #check for player-shield pickup collisions
-        if(self.checkPlayerShieldPickupCollisions()):
-            print("SHIELD ACTIVATED!!!")
-            self.world.component_for_entity(player, Player).shieldsAvailable += 1 #activateShield()
-
-    def checkPlayerShieldPickupCollisions(self):
-        collisionDetected = False
+        self.rebuildGrids()
+        self.findCollisions()
+        collision_events.dispatch()
+
+    # puts every enemy, fuel strip and shield pickup in the grid for its kind
+    def rebuildGrids(self):
+        for grid, kind in ((self.enemies, Enemy), (self.fuel_strips, FuelStrip), (self.shield_pickups, ShieldPickup)):
+            grid.clear()
+            for ent, (_, pos, col) in self.world.get_components(kind, Position, Collider):
+                grid.insert(ent, pos.x, pos.y, col.t_width, col.t_height)
+        self.fuel_strip_targets.clear()
+        for ent, (_, pos) in self.world.get_components(FuelStrip, Position):
+            self.fuel_strip_targets.insert(ent, *fuelStripTarget(pos.x, pos.y))
+
+    # emits every collision of the frame, each one once
+    def findCollisions(self):
         player_pos = self.world.component_for_entity(player, Position)
         player_collider = self.world.component_for_entity(player, Collider)
-        for ent, (_, pos, col) in self.world.get_components(ShieldPickup, Position, Collider):
-            if (self.checkCollision(player_pos, player_collider, pos, col)):
-                collisionDetected = True
-                self.world.delete_entity(ent)
-                break
-        return collisionDetected
+        player_box = (player_pos.x, player_pos.y, player_collider.t_width, player_collider.t_height)
 
-    def checkPlayerFuelStripCollisions(self):
-        collisionDetected = False
-        player_pos = self.world.component_for_entity(player, Position)
-        player_collider = self.world.component_for_entity(player, Collider)
-        for ent, (_, pos, col) in self.world.get_components(FuelStrip, Position, Collider):
-            if (self.checkCollision(player_pos, player_collider, pos, col)):
-                collisionDetected = True
+        # check for player-land collisions
+        if (self.checkForLandCollision(player_pos, player_collider)):
+            collision_events.emit(PLAYER_LAND, player)
+
+        # check for player-enemy, player-fuel and player-shield pickup collisions.
+        # Only the first one of each kind counts
+        for kind, grid in ((PLAYER_ENEMY, self.enemies), (PLAYER_FUEL_STRIP, self.fuel_strips),
+                           (PLAYER_SHIELD_PICKUP, self.shield_pickups)):
+            for ent in grid.query(*player_box):
+                collision_events.emit(kind, player, ent)
                 break
-        return collisionDetected
 
-    # returns true if the player hits land, otherwise false
-    def checkPlayerEnemyCollisions(self):
-        collisionDetected = False
-        player_pos = self.world.component_for_entity(player, Position)
-        player_collider = self.world.component_for_entity(player, Collider)
-        for ent, (_, pos, col) in self.world.get_components(Enemy, Position, Collider):
-            if (self.checkCollision(player_pos, player_collider, pos, col)):
-                if(self.world.component_for_entity(player, Player).shielded):
-                    self.world.delete_entity(ent)
-                collisionDetected = True
-                break
-        return collisionDetected
+        the_terrain = self.world.component_for_entity(terrain, Terrain)
+        if BATCHED_BULLETS:
+            self.findBulletCollisionsBatched(the_terrain, player_box)
+            return
 
-        # returns true if entity one is colliding with entity two
+        # check for bullet-enemy, bullet-fuel strip and bullet-land collisions, on
+        # every tile the bullet passed through, in order. The first one spends it
+        for bullet_ent, bullet in self.world.get_component(Bullet):
+            for x, y in bulletPath(bullet):
+                for enemy_ent in self.enemies.query(x, y):
+                    collision_events.emit(BULLET_ENEMY, bullet_ent, enemy_ent)
+                for fuel_ent in self.fuel_strip_targets.query(x, y):
+                    collision_events.emit(BULLET_FUEL_STRIP, bullet_ent, fuel_ent)
+                if (the_terrain.screen_has_land(x, x + 1, y, y + 1)):
+                    collision_events.emit(BULLET_LAND, bullet_ent)
 
-    def checkCollision(self, entOnePos, entOneCollider, entTwoPos, entTwoCollider):
-        entOneRect = entOneCollider.colliderToRect(entOnePos)
-        entTwoRect = entTwoCollider.colliderToRect(entTwoPos)
-        # pygame.draw.rect(win,(0,0,0),entTwoRect)
-        # pygame.display.flip()
-        return entOneRect.colliderect(entTwoRect)
+        # check for player-enemy_bullet collisions
+        for bullet_ent, enemy_bullet in self.world.get_component(EnemyBullet):
+            if collision.overlaps_path(bulletPath(enemy_bullet), *player_box) >= 0:
+                collision_events.emit(ENEMY_BULLET_PLAYER, bullet_ent, player)
+
+    # the same bullet checks as findCollisions, for every bullet at once, using
+    # their array columns. Emits the same collisions, in the same order
+    def findBulletCollisionsBatched(self, the_terrain, player_box):
+        bullets = self.world.array_store(Bullet)
+        if len(bullets.ids()):
+            # a row of tiles for every step along the bullets' paths
+            xs, ys, valid = collision.path_steps(bullets.field('last_x'), bullets.field('last_y'),
+                                                 bullets.field('x'), bullets.field('y'))
+            enemy_ents, enemy_boxes = self.colliderArrays(Enemy)
+            fuel_ents, (fuel_xs, fuel_ys, _, _) = self.colliderArrays(FuelStrip)
+            fuel_boxes = fuelStripTarget(fuel_xs, fuel_ys)
+            enemy_hits = collision.first_hits(xs.ravel(), ys.ravel(), enemy_boxes).reshape(xs.shape)
+            fuel_hits = collision.first_hits(xs.ravel(), ys.ravel(), fuel_boxes).reshape(xs.shape)
+            land_hits = collision.land_hits(xs.ravel(), ys.ravel(), the_terrain.visible_land).reshape(xs.shape)
+            hit = ((enemy_hits >= 0) | (fuel_hits >= 0) | land_hits) & valid
+            bullet_ents = bullets.ids()
+            # only the bullets that hit something are looked at one by one
+            for i in np.flatnonzero(hit.any(axis=0)).tolist():
+                bullet_ent = int(bullet_ents[i])
+                for step in np.flatnonzero(hit[:, i]).tolist():
+                    if enemy_hits[step, i] >= 0:
+                        collision_events.emit(BULLET_ENEMY, bullet_ent, enemy_ents[enemy_hits[step, i]])
+                    if fuel_hits[step, i] >= 0:
+                        collision_events.emit(BULLET_FUEL_STRIP, bullet_ent, fuel_ents[fuel_hits[step, i]])
+                    if land_hits[step, i]:
+                        collision_events.emit(BULLET_LAND, bullet_ent)
+
+        enemy_bullets = self.world.array_store(EnemyBullet)
+        on_player = collision.paths_overlap(enemy_bullets.field('last_x'), enemy_bullets.field('last_y'),
+                                            enemy_bullets.field('x'), enemy_bullets.field('y'), *player_box)
+        for bullet_ent in enemy_bullets.ids()[on_player].tolist():
+            collision_events.emit(ENEMY_BULLET_PLAYER, bullet_ent, player)
+
+    # returns the entities of a kind, and their colliders as (xs, ys, widths, heights)
+    # arrays, see collision.first_hits
+    def colliderArrays(self, kind):
+        ents = []
+        boxes = []
+        for ent, (_, pos, col) in self.world.get_components(kind, Position, Collider):
+            ents.append(ent)
+            boxes.append((pos.x, pos.y, col.t_width, col.t_height))
+        boxes = np.array(boxes, dtype=np.int64).reshape(len(ents), 4)
+        return ents, tuple(boxes.T)
+
+    def playerHitLand(self, player_ent, _):
+        # print("player hit land")
+        if(not self.world.component_for_entity(player_ent, Player).shielded):
+            self.world.component_for_entity(player_ent, Player).kill()
+
+    def playerHitEnemy(self, player_ent, enemy_ent):
+        # print("player hit enemy")
+        if(self.world.component_for_entity(player_ent, Player).shielded):
+            deleteCollided(enemy_ent)
+        else:
+            self.world.component_for_entity(player_ent, Player).kill()
 
-    # checks for ON-SCREEN COLLISIONS only
-    def checkForLandCollision(self, positionComponent, colliderComponent):
-        landTileRects = []
-        # create a collider for all on-screen land tiles ...
-        for _, terrain in world.get_component(Terrain):
-            for x in range(terrain.terrain_width):  # for each column
-                row = 0  # row is the on-screen row number
-                # for each row that is currently on the screen ...
-                for y in range((terrain.scroll_pos - (terrain.terrain_height // 2)), terrain.scroll_pos):
-                    if (terrain.tile_matrix[x][y].tile_type == Tiles.LAND):  # if tile is land create a Rect for it
-                        landTileRects.append(pygame.Rect(x * TILE_WIDTH, row * TILE_HEIGHT, TILE_WIDTH, TILE_HEIGHT))
-                    row += 1
+    def playerHitFuelStrip(self, player_ent, _):
+        # print("player refueling")
+        self.world.component_for_entity(player_ent, Player).refuel()
 
-        # create a pygame Rect out the two components
-        other = colliderComponent.colliderToRect(positionComponent)
+    def playerHitShieldPickup(self, player_ent, pickup_ent):
+        print("SHIELD ACTIVATED!!!")
+        deleteCollided(pickup_ent)
+        self.world.component_for_entity(player_ent, Player).shieldsAvailable += 1 #activateShield()
 
+    # checks for ON-SCREEN COLLISIONS only
+    def checkForLandCollision(self, positionComponent, colliderComponent):
         collisionDetected = False
-        for landTile in landTileRects:  # for each land tile rect
-            if landTile.colliderect(other):  # check if the 'other' collider is hitting a land tile
+        for _, terrain in world.get_component(Terrain):
+            # check if the on-screen tiles under the collider hold any land,
+            # using the land bitmap of the screen
+            if terrain.screen_has_land(positionComponent.x,
+                                       positionComponent.x + colliderComponent.t_width,
+                                       positionComponent.y,
+                                       positionComponent.y + colliderComponent.t_height):
                 collisionDetected = True
-                break
 
         return collisionDetected
 
@@ -593,20 +726,19 @@ class RefuelingSystem(esper.Processor):
 
 # Movement System
 class MovementSystem(esper.Processor):
+    # move everything once per scroll, on the frame before the terrain scrolls
+    interval = TERRAIN_SCROLL_DELAY
+    phase = TERRAIN_SCROLL_DELAY - 1
+
     def __init__(self):
         super().__init__()
-        self.movementDelay = TERRAIN_SCROLL_DELAY
-        self.currentDelay = 0
 
     def process(self):
-        self.currentDelay += 1
-        if (self.currentDelay >= self.movementDelay):  # move everything every movementDelay number of frames
-            self.currentDelay = 0
-            self.movePlayer()
-            self.moveBoats()
-            self.moveJets()
-            self.moveHelicopters()
-            self.moveEnhancedHelicopters()
+        self.movePlayer()
+        self.moveBoats()
+        self.moveJets()
+        self.moveHelicopters()
+        self.moveEnhancedHelicopters()
 
     def moveEnhancedHelicopters(self):
         for ent, (enheli, vel, pos, col, rend) in self.world.get_components(EnhancedHeli, Velocity, Position, Collider, Renderable):
@@ -642,18 +774,33 @@ class MovementSystem(esper.Processor):
                 pos.x += vel.x  # change position based on velocity
 
     def moveJets(self):
-        for ent, (jet, vel, pos, col, rend) in self.world.get_components(Jet, Velocity, Position, Collider, Renderable):
-            if (pos.y >= 0):  # if the jets are on screen
-                pos.y += vel.y
+        jets = [ent for ent, _ in self.world.get_components(Jet, Velocity, Position, Collider, Renderable)]
+        if jets:
+            positions = self.world.array_store(Position)
+            velocities = self.world.array_store(Velocity)
+            pos_rows = positions.rows_for(jets)
+            vel_rows = velocities.rows_for(jets)
+            on_screen = positions.columns['y'][pos_rows] >= 0  # if the jets are on screen
+            positions.columns['y'][pos_rows[on_screen]] += velocities.columns['y'][vel_rows[on_screen]]
 
 class EnhancedHeli:
     None
 
 
+# returns the tiles a bullet passed through this frame, in order. The tile it
+# started on was checked last frame, but a new bullet is checked on its own tile
+def bulletPath(bullet):
+    tiles = collision.traverse(bullet.last_x, bullet.last_y, bullet.x, bullet.y)
+    return tiles[1:] or tiles
+
+
 class Bullet:
     def __init__(self, x, y, x_vel, y_vel, lifespan=BULLET_LIFESPAN):
         self.x = x
         self.y = y
+        # where the bullet was before it last moved
+        self.last_x = x
+        self.last_y = y
         self.lifespan = lifespan
         self.time_alive = 0
         self.x_vel = x_vel
@@ -664,88 +811,93 @@ class EnemyBullet:
     def __init__(self, x, y, x_vel, y_vel, lifespan=BULLET_LIFESPAN):
         self.x = x
         self.y = y
+        self.last_x = x
+        self.last_y = y
         self.lifespan = 10
         self.time_alive = 0
         self.x_vel = x_vel
         self.y_vel = y_vel
 
 
+# Moves the bullets, and acts on their collisions, which the ColliderSystem finds
+# after it
 class BulletSystem(esper.Processor):
     enemy_bullet_movement_delay = TERRAIN_SCROLL_DELAY
     delay_counter = 0
 
     def __init__(self):
         super().__init__()
+        collision_events.subscribe(BULLET_ENEMY, self.bulletHitEnemy)
+        collision_events.subscribe(BULLET_FUEL_STRIP, self.bulletHitFuelStrip)
+        collision_events.subscribe(BULLET_LAND, self.bulletHitLand)
+        collision_events.subscribe(ENEMY_BULLET_PLAYER, self.enemyBulletHitPlayer)
 
     def process(self):
-        for ent, bullet in self.world.get_component(Bullet):
-            if (bullet.time_alive >= bullet.lifespan):
-                self.world.delete_entity(ent)
-            else:
-                bullet.x += bullet.x_vel
-                bullet.y += bullet.y_vel
-                bullet.time_alive += 1
-
-        for ent, enemy_bullet in self.world.get_component(EnemyBullet):
-            if (enemy_bullet.time_alive >= enemy_bullet.lifespan):
-                self.world.delete_entity(ent)
-            else:
-                restDelay = True
-                enemy_bullet.x += enemy_bullet.x_vel
-                enemy_bullet.y += enemy_bullet.y_vel
-                enemy_bullet.time_alive += 1
-
+        # expire and advance all bullets at once, using their array columns
+        for bullet_type in (Bullet, EnemyBullet):
+            bullets = self.world.array_store(bullet_type)
+            time_alive = bullets.field('time_alive')
+            expired = time_alive >= bullets.field('lifespan')
+            for ent in bullets.ids()[expired]:
+                deleteCollided(int(ent))
+            alive = ~expired
+            bullets.field('last_x')[:] = bullets.field('x')
+            bullets.field('last_y')[:] = bullets.field('y')
+            bullets.field('x')[alive] += bullets.field('x_vel')[alive] * BULLET_SPEED
+            bullets.field('y')[alive] += bullets.field('y_vel')[alive] * BULLET_SPEED
+            # counted in tiles moved, see BULLET_LIFESPAN
+            time_alive[alive] += BULLET_SPEED
+
+        volley = []  # every helicopter's bullets are created together
         for ent, (heli_comp, pos) in self.world.get_components(Helicopter, Position):
             heli_comp.shoot_counter += 1
             if (heli_comp.shoot_counter >= heli_comp.shoot_delay):
-                self.enemy_shoot(pos.x, pos.y - 1, 0, -1)
-                self.enemy_shoot(pos.x + 1, pos.y, 1, 0)
-                self.enemy_shoot(pos.x, pos.y + 1, 0, 1)
-                self.enemy_shoot(pos.x - 1, pos.y, -1, 0)
+                self.enemy_shoot(pos.x, pos.y - 1, 0, -1, volley)
+                self.enemy_shoot(pos.x + 1, pos.y, 1, 0, volley)
+                self.enemy_shoot(pos.x, pos.y + 1, 0, 1, volley)
+                self.enemy_shoot(pos.x - 1, pos.y, -1, 0, volley)
                 heli_comp.shoot_counter = 0
+        if volley:
+            self.world.create_entities(volley)
 
-        for bullet_ent, bullet in self.world.get_component(Bullet):
-            # check for bullet enemy collisions
-            for enemy_ent, (enemy, enemy_position, enemy_collider) in self.world.get_components(Enemy, Position,
-                                                                                                Collider):
-                if ((bullet.x >= enemy_position.x and bullet.x < enemy_position.x + enemy_collider.t_width) and (
-                        bullet.y >= enemy_position.y and bullet.y < enemy_position.y + enemy_collider.t_height)):
-                    self.world.delete_entity(enemy_ent)
-                    self.world.delete_entity(bullet_ent)
-                    itr = self.world.get_component(Player)
-                    itr[0][1].score += 10
-
-            # check for bullet-fuel strip collisions
-            for fuel_ent, (fs, pos) in self.world.get_components(FuelStrip, Position):
-                if ((bullet.x == pos.x and bullet.y == pos.y) or (bullet.x == pos.x and bullet.y == (pos.y - 1))):
-                    self.world.delete_entity(fuel_ent)
-                    self.world.delete_entity(bullet_ent)
-
-            # check for bullet-land collsions
-            if (self.world.get_processor(ColliderSystem).checkForLandCollision(Position(bullet.x, bullet.y),
-                                                                               Collider(1, 1))):
-                self.world.delete_entity(bullet_ent)
+    # hits are recorded in the world's command buffer, so the deletions are
+    # applied together at the end of the frame instead of one at a time.
+    # A bullet is spent on the first thing it hits
+    def bulletHitEnemy(self, bullet_ent, enemy_ent):
+        deleteCollided(enemy_ent)
+        deleteCollided(bullet_ent)
+        itr = self.world.get_component(Player)
+        itr[0][1].score += 10
 
-        # check for player-enemy_bullet collisions
-        for ent, (player, player_position) in self.world.get_components(Player, Position):
-            for _, enemy_bullet in self.world.get_component(EnemyBullet):
-                if (enemy_bullet.x == player_position.x and enemy_bullet.y == player_position.y):
-                    if(not player.shielded):
-                        player.kill()
+    def bulletHitFuelStrip(self, bullet_ent, fuel_ent):
+        deleteCollided(fuel_ent)
+        deleteCollided(bullet_ent)
+
+    def bulletHitLand(self, bullet_ent, _):
+        deleteCollided(bullet_ent)
+
+    def enemyBulletHitPlayer(self, bullet_ent, player_ent):
+        if(not self.world.component_for_entity(player_ent, Player).shielded):
+            self.world.component_for_entity(player_ent, Player).kill()
 
     def player_shoot(self, x, y, x_vel, y_vel):
         self.world.component_for_entity(player, Player).fuel -= SHOOT_DEFUEL_PENALTY
         world.create_entity(
             Bullet(x, y, x_vel, y_vel),
-            Renderable(pygame.image.load("./images/bullet.png"))
+            Renderable(load_sprite("./images/bullet.png"))
         )
 
-    def enemy_shoot(self, x, y, x_vel, y_vel):
+    # if batch is given, the bullet's components are added to it instead of being created right away
+    def enemy_shoot(self, x, y, x_vel, y_vel, batch=None):
         #print("enemy_shoot()")
-        world.create_entity(
+        components = (
             EnemyBullet(x, y, x_vel, y_vel),
-            Renderable(pygame.image.load("./images/enemy_bullet.png"))
+            Renderable(load_sprite("./images/enemy_bullet.png"))
         )
+        if batch is None:
+            world.create_entity(*components)
+        else:
+            batch.append(components)
 
 
 class Enemy:
@@ -778,41 +930,40 @@ class Bridge:
 
 
 class EnemySystem(esper.Processor):
+    # drop bombs once per scroll, along with the movement step
+    interval = TERRAIN_SCROLL_DELAY
+    phase = TERRAIN_SCROLL_DELAY - 1
+
     def __init__(self):
         super().__init__()
-        self.delay = 30
-        self.current_delay = 0
 
     def process(self):
-        self.current_delay += 1
-        if(self.current_delay >= self.delay):
-            self.current_delay = 0
-            self.dropHeliBomb()
+        self.dropHeliBomb()
         
     def dropHeliBomb(self):
         for ent, (enheli, pos, col) in world.get_components(EnhancedHeli, Position, Collider):
             #if (not self.world.get_processor(ColliderSystem).checkForLandCollision(Position(pos.x, pos.y), col)):
             #randomNumber = random.randint(1, 3)
             #if (randomNumber == 2): #1/100 chance to drop bomb every tick
-            if(pos.x >= 0 and pos.x <= 30):#Only spawn if on screen
-                self.world.get_processor(SpawnSystem).spawnBomb(pos.x, pos.y)
+            if(pos.x >= 0 and pos.x <= COLUMNS):#Only spawn if on screen
+                self.world.get_processor(SpawnSystem).spawnBomb(pos.x, pos.y, self.world.commands)
 
     def deleteHeli(self):
         for ent, (enheli, pos) in self.world.get_components(EnhancedHeli, Position):
-            if (pos.x < 0 or pos.x > TILE_WIDTH):
-                self.world.delete_entity(ent)
+            if (pos.x < 0 or pos.x > COLUMNS):
+                self.world.commands.delete_entity(ent)
 
 
 # class that spawns in objects, draws objects, moves enemies, and contains all objects
-class Spawner:
+class Spawner(terrain_gen.SpawnRules):
     def __init__(self):
-        self.enemy_type_count = 4
-        self.initial_spawn_attempts = 4
-        self.chunks_required_to_increase_spawn_attempts = 2  # spawn attempts will after this many new chunks have been generated
+        super().__init__()
+        self.boat_size = (BOAT_WIDTH, BOAT_HEIGHT)
+        self.heli_size = (BOAT_WIDTH, BOAT_HEIGHT)
+        self.fuel_strip_size = (FUEL_WIDTH, FUEL_HEIGHT)
+        self.shield_pickup_size = (FUEL_WIDTH, FUEL_HEIGHT)
         self.chunk_generation_count = 0  # how many times a new chunck has been generated
         self.spawn_attempts = 5
-        self.fuel_strip_spawn_attempts = 3
-        self.chunks_before_shield_spawn_attempt = 4
 
 class ShieldPickup:
     def __init__(self):
@@ -825,153 +976,142 @@ class ShieldPickup:
 class SpawnSystem(esper.Processor):
     def __init__(self):
         super().__init__()
+        # spawn method for each kind of planned spawn, see terrain_gen.SpawnRules
+        self.spawn_methods = {
+            'boat': self.spawnBoat,
+            'heli': self.spawnHeli,
+            'jet': self.spawnJet,
+            'enhanced_heli': self.spawnEnhancedHeli,
+            'fuel_strip': self.spawnFuelStrip,
+            'bridge': self.spawnBridge,
+            'shield_pickup': self.spawnShieldPickup,
+        }
 
     def process(self):
         None
 
-    def spawnEnemies(self):
+    # spawns everything planned for a new chunk, see terrain_gen.SpawnRules.plan
+    def spawnEnemies(self, chunk):
         the_spawner = self.world.component_for_entity(spawner, Spawner)
-        the_spawner.chunk_generation_count += 1
-        the_spawner.spawn_attempts = (the_spawner.chunk_generation_count // the_spawner.chunks_required_to_increase_spawn_attempts) + the_spawner.initial_spawn_attempts
+        the_spawner.chunk_generation_count = chunk.index
+        the_spawner.spawn_attempts = the_spawner.enemy_spawn_attempts(chunk.index)
         print("spawn attempts = " + str(the_spawner.spawn_attempts))
+        batch = []  # everything in the chunk is created at once, at the end
+        for kind, *args in chunk.spawns:
+            self.spawn_methods[kind](*args, batch)
+        self.world.create_entities(batch)
+
+    # creates an entity right away, or adds its components to batch so that
+    # a whole set of entities can be created at once with create_entities.
+    # batch can also be a command buffer, to create the entity at the end of the frame
+    def createEntity(self, batch, *components):
+        if batch is None:
+            world.create_entity(*components)
+        elif isinstance(batch, esper.CommandBuffer):
+            batch.create_entity(*components)
+        else:
+            batch.append(components)
 
-        # spawn enemies
-        for i in range(the_spawner.spawn_attempts):
-            the_terrain = self.world.component_for_entity(terrain, Terrain)
-            randomX = random.randint(0, the_terrain.terrain_width)
-            randomY = random.randint(0, the_terrain.terrain_width)
-            # randomY = random.randint(-(the_terrain.terrain_height // 2), -1)
-
-            randomNumber = random.randint(1, the_spawner.enemy_type_count)
-
-            if (randomNumber == 1):
-                self.spawnBoat(randomX, randomY)
-            elif (randomNumber == 2):
-                self.spawnHeli(randomX, randomY)
-            elif (randomNumber == 3):
-                self.spawnJet(randomX, randomY)
-            elif (randomNumber == 4):
-                if (randomX > the_terrain.terrain_width / 2): #spawn heli on left side
-                    self.spawnEnhancedHeli(30, randomY)
-                if (randomX <= the_terrain.terrain_width / 2): #spawn heli on right side
-                    self.spawnEnhancedHeli(0, randomY)
-
-        # spawn fuel strips
-        for i in range(the_spawner.fuel_strip_spawn_attempts):
-            the_terrain = self.world.component_for_entity(terrain, Terrain)
-            randomX = random.randint(0, the_terrain.terrain_width)
-            randomY = random.randint(0, the_terrain.terrain_width)
-            self.spawnFuelStrip(randomX, randomY)
-
-        # spawn bridges
-        randomNum = random.randint(0, 3)
-        if (randomNum == 0):
-            print("   spawnbridge")
-            self.spawnBridge()
-
-        #spawn shields
-        if(the_spawner.chunk_generation_count % the_spawner.chunks_before_shield_spawn_attempt == 0):
-            the_terrain = self.world.component_for_entity(terrain, Terrain)
-            randomX = random.randint(0, the_terrain.terrain_width)
-            randomY = random.randint(0, the_terrain.terrain_width)
-            self.spawnShieldPickup(randomX,randomY)
-
-
-    def spawnShieldPickup(self, xpos, ypos):
-        if (not self.CheckForNewChunkLandCollision(xpos, ypos, FUEL_WIDTH, FUEL_HEIGHT)):
-            world.create_entity(
-                ShieldPickup(),
-                Position(xpos, (-ROWS + ypos)),
-                Velocity(0, 0),
-                Renderable(pygame.image.load("./images/shield_drop.png")),
-                Collider(SHIELD_PICKUP_WIDTH, SHIELD_PICKUP_HEIGHT)
-            )
+    def spawnShieldPickup(self, xpos, ypos, batch=None):
+        self.createEntity(
+            batch,
+            ShieldPickup(),
+            Position(xpos, (-ROWS + ypos)),
+            Velocity(0, 0),
+            Renderable(load_sprite("./images/shield_drop.png")),
+            Collider(SHIELD_PICKUP_WIDTH, SHIELD_PICKUP_HEIGHT)
+        )
 
-    def spawnBridge(self):
-        world.create_entity(
+    def spawnBridge(self, batch=None):
+        print("   spawnbridge")
+        self.createEntity(
+            batch,
             Enemy(),
             Bridge(),
-            Position(0, -30),
-            Renderable(pygame.image.load("./images/bridge.png")),
+            Position(0, -ROWS),
+            Renderable(pygame.transform.scale(pygame.image.load("./images/bridge.png"),
+                                              (BRIDGE_WIDTH * TILE_WIDTH, BRIDGE_HEIGHT * TILE_HEIGHT))),
             Collider(BRIDGE_WIDTH, BRIDGE_HEIGHT)
         )
 
-    def spawnFuelStrip(self, xpos, ypos):
-        # if (not self.CheckForNewChunkLandCollision(Position(xpos, ypos), Collider(FUEL_WIDTH, FUEL_HEIGHT))):
-        if (not self.CheckForNewChunkLandCollision(xpos, ypos, FUEL_WIDTH, FUEL_HEIGHT)):
-            world.create_entity(
-                FuelStrip(),
-                Position(xpos, (-ROWS + ypos)),
-                Velocity(0, 0),
-                Renderable(pygame.image.load("./images/Fuel2.png")),
-                Collider(FUEL_WIDTH, FUEL_HEIGHT)
-            )
+    # land checks for spawns are done when they are planned, see terrain_gen.SpawnRules
+    def spawnFuelStrip(self, xpos, ypos, batch=None):
+        self.createEntity(
+            batch,
+            FuelStrip(),
+            Position(xpos, (-ROWS + ypos)),
+            Velocity(0, 0),
+            Renderable(load_sprite("./images/Fuel2.png")),
+            Collider(FUEL_WIDTH, FUEL_HEIGHT)
+        )
 
-    def spawnBoat(self, xpos, ypos):
-        # if boat will not spawn on land at this rand x,y position
-        # if (not self.CheckForNewChunkLandCollision(Position(xpos, ypos), Collider(BOAT_WIDTH, BOAT_HEIGHT))):
-        if (not self.CheckForNewChunkLandCollision(xpos, ypos, BOAT_WIDTH, BOAT_HEIGHT)):
-            world.create_entity(
-                Enemy(),  # all enemies must have this component for enemy-player collisions to work
-                Boat(),  # usefull for the moveBoat function
-                Position(xpos, (-ROWS + ypos)),
-                Velocity(BOAT_START_VELOCITY_X, BOAT_START_VELOCITY_Y),
-                Renderable(pygame.image.load("./images/boat3.png")),
-                Collider(BOAT_WIDTH, BOAT_HEIGHT)
-            )
+    def spawnBoat(self, xpos, ypos, batch=None):
+        self.createEntity(
+            batch,
+            Enemy(),  # all enemies must have this component for enemy-player collisions to work
+            Boat(),  # usefull for the moveBoat function
+            Position(xpos, (-ROWS + ypos)),
+            Velocity(BOAT_START_VELOCITY_X, BOAT_START_VELOCITY_Y),
+            Renderable(load_sprite("./images/boat3.png")),
+            Collider(BOAT_WIDTH, BOAT_HEIGHT)
+        )
 
-    def spawnHeli(self, xpos, ypos):
-        if (not self.CheckForNewChunkLandCollision(xpos, ypos, BOAT_WIDTH, BOAT_HEIGHT)):
-            world.create_entity(
-                Enemy(),  # all enemies must have this component for enemy-player collisions to work
-                Helicopter(random.randint(5, 20)),  
-                Position(xpos, (-ROWS + ypos)),
-                Velocity(HELI_START_VELOCITY_X, HELI_START_VELOCITY_Y),
-                Renderable(pygame.image.load("./images/heli2.png")),
-                Collider(HELI_WIDTH, HELI_HEIGHT)
-            )
-            # self.spawnBoat(xpos,ypos)
+    def spawnHeli(self, xpos, ypos, shoot_delay, batch=None):
+        self.createEntity(
+            batch,
+            Enemy(),  # all enemies must have this component for enemy-player collisions to work
+            Helicopter(shoot_delay),
+            Position(xpos, (-ROWS + ypos)),
+            Velocity(HELI_START_VELOCITY_X, HELI_START_VELOCITY_Y),
+            Renderable(load_sprite("./images/heli2.png")),
+            Collider(HELI_WIDTH, HELI_HEIGHT)
+        )
+        # self.spawnBoat(xpos,ypos)
 
-    def spawnJet(self, xpos, ypos):
-        world.create_entity(
+    def spawnJet(self, xpos, ypos, batch=None):
+        self.createEntity(
+            batch,
             Enemy(),
             Jet(),
             Position(xpos, (-ROWS + ypos)),
             Velocity(JET_START_VELOCITY_X, JET_START_VELOCITY_Y),
-            Renderable(pygame.image.load("./images/jet.png")),
+            Renderable(load_sprite("./images/jet.png")),
             Collider(JET_WIDTH, JET_HEIGHT)
         )
         # print("spawnJet()")
 
-    def spawnBomb(self, xpos, ypos):
+    def spawnBomb(self, xpos, ypos, batch=None):
         #if( not self.CheckForNewChunkLandCollision(xpos, ypos, BOMB_WIDTH, BOMB_HEIGHT)):
-        world.create_entity(
+        self.createEntity(
+            batch,
 	        Enemy(),
 	        Bomb(),
 	        Position(xpos, ypos),
             Velocity(0, 0),
-            Renderable(pygame.image.load("./images/bomb.png")),
+            Renderable(load_sprite("./images/bomb.png")),
             Collider(BOMB_WIDTH, BOMB_HEIGHT)
         )
 
 
-    def spawnEnhancedHeli(self, xpos, ypos):
+    def spawnEnhancedHeli(self, xpos, ypos, batch=None):
         if(xpos == 0): #If heli is on left side of screen
-            world.create_entity(
+            self.createEntity(
+            batch,
             Enemy(),
             EnhancedHeli(),
             Position(xpos, (-ROWS + ypos)),
             Velocity(HELI_START_VELOCITY_X, HELI_START_VELOCITY_Y),
-            Renderable(pygame.image.load("./images/enhanced_heli.png")),
+            Renderable(load_sprite("./images/enhanced_heli.png")),
             Collider(HELI_WIDTH, HELI_HEIGHT)
 	        )
         else:        #Heli is on right side of screen
-            world.create_entity(
+            self.createEntity(
+                batch,
                 Enemy(),
                 EnhancedHeli(),
                 Position(xpos, (-ROWS + ypos)),
                 Velocity(-HELI_START_VELOCITY_X, HELI_START_VELOCITY_Y),
-                Renderable(pygame.transform.rotate(pygame.image.load("./images/enhanced_heli.png"), -180)),
+                Renderable(pygame.transform.rotate(load_sprite("./images/enhanced_heli.png"), -180)),
                 Collider(HELI_WIDTH, HELI_HEIGHT)
             )
 
@@ -983,19 +1123,6 @@ class SpawnSystem(esper.Processor):
         # print("spawnTurretBoat()")
         None
 
-    def CheckForNewChunkLandCollision(self, index_pos_x, index_pos_y, coll_width, coll_height):
-        collisionDetected = False
-        for _, terrain in world.get_component(Terrain):
-            for x in range(coll_width):
-                for y in range(coll_height):
-                    if (index_pos_x + x >= terrain.terrain_width):
-                        collisionDetected = True
-                        break
-                    if (terrain.tile_matrix[index_pos_x + x][index_pos_y + y].tile_type == Tiles.LAND):
-                        collisionDetected = True
-                        break
-
-        return collisionDetected
 
 
         # # returns true if the an entity will spawn in on land, this checks for OFF-SCREEN LAND COLLISIONS
@@ -1018,78 +1145,44 @@ class SpawnSystem(esper.Processor):
         #     return collisionDetected
 
 
-class Terrain:
-    def __init__(self,
-                 scroll_delay=TERRAIN_SCROLL_DELAY,
-                 terrain_width=(SCREEN_WIDTH // TILE_WIDTH),
-                 terrain_height=((SCREEN_HEIGHT // TILE_HEIGHT) * 2),
-                 ):
-        self.tile_matrix = []
-        # Frames per scroll
-        self.scroll_delay = scroll_delay
-        # Width in tiles
-        self.terrain_width = terrain_width
-        # Height in tiles
-        self.terrain_height = terrain_height
-
-        self.scroll_pos = terrain_height - 1
-
-        self.initialized = False
-
-    def get_scroll(self):
-        return self.scroll_pos
-
-
-# Enum for terrain tile types
-class Tiles(Enum):
-    WATER = 0
-    LAND = 1
-
-
-class TerrainTile:
-    lower_bound_land = 200
-    upper_bound_land = 220
-
-    lower_bound_water = 240
-    upper_bound_water = 250
-
-    def __init__(self, tile_type):
-        self.set_tile_type(tile_type)
-
-    def set_tile_type(self, tile_type):
-        self.tile_type = tile_type
-        if (tile_type == Tiles.WATER):
-            self.color = (0, 0, random.randint(self.lower_bound_water, self.upper_bound_water))
-        else:
-            self.color = (0, random.randint(self.lower_bound_land, self.upper_bound_land), 0)
-
-
 class TerrainSystem(esper.Processor):
+    # runs once per scroll; the very first run (tick 0) initializes the terrain
+    interval = TERRAIN_SCROLL_DELAY
+
     def __init__(self,
-                 carving_center=(SCREEN_WIDTH // TILE_WIDTH // 2),
+                 carving_center=(COLUMNS // 2),
                  generation_steps=6,
                  neighbors_for_murder=4,
                  neighbors_for_rebirth=3,
-                 start_alive_prob=0.35):
+                 start_alive_prob=0.35,
+                 seed=TERRAIN_SEED,
+                 cache_size=CHUNK_CACHE_SIZE,
+                 library=CHUNK_LIBRARY):
         super().__init__()
-        # Cellular Automata Parameters
-        self.carving_center = carving_center
-        self.generation_steps = generation_steps
-        self.neighbors_for_murder = neighbors_for_murder
-        self.neighbors_for_rebirth = neighbors_for_rebirth
-        self.start_alive_prob = start_alive_prob
-        # Frames since last scroll
-        self.current_delay = 0
+        # chunks already generated for a seed are reused
+        self.chunk_cache = terrain_gen.ChunkCache(cache_size)
+        # Cellular Automata Parameters, see terrain_gen
+        self.generator = terrain_gen.ChunkGenerator(COLUMNS, ROWS,
+                                                    carving_center,
+                                                    generation_steps,
+                                                    neighbors_for_murder,
+                                                    neighbors_for_rebirth,
+                                                    start_alive_prob,
+                                                    cache=self.chunk_cache)
+        # Terrain seed, or None for a new one every episode
+        self.seed = seed
+        self.episode_seed = None
+        # pre-generated episodes to replay instead, see chunklib
+        self.library = None if library is None else chunklib.ChunkLibrary(library)
+        self.episode = 0
+        # upcoming chunks are generated ahead of time, so loading one is just a swap
+        self.producer = terrain_gen.ChunkProducer(PREPARED_CHUNKS)
 
     def process(self):
         for _, (terrain) in self.world.get_component(Terrain):
             if not (terrain.initialized):
-                # Initialized terrain to WIDTHxHEIGHT water tiles
-                for i in range(0, terrain.terrain_width):
-                    terrain.tile_matrix.append([])
-                    for j in range(0, terrain.terrain_height):
-                        terrain.tile_matrix[i].append(TerrainTile(Tiles.WATER))
-                # Then actually put it some effort and make it decent
+                # Terrain starts out as WIDTHxHEIGHT water tiles,
+                # so actually put it some effort and make it decent
                 self.generate_initial_terrain(terrain)
                 terrain.initialized = True
             else:
@@ -1097,169 +1190,99 @@ class TerrainSystem(esper.Processor):
 
     # Populates terrain with land on sides of screen
     def generate_initial_terrain(self, terrain):
-        for y in range(terrain.terrain_height // 2, terrain.terrain_height):
-            for x in range(0, 3):
-                terrain.tile_matrix[x][y].set_tile_type(Tiles.LAND)
-            for x in range(terrain.terrain_width - 3, terrain.terrain_width):
-                terrain.tile_matrix[x][y].set_tile_type(Tiles.LAND)
-        self.generate_chunk(terrain, self.generate_noise())
+        lower_half = slice(terrain.terrain_height // 2, terrain.terrain_height)
+        below = terrain_gen.initial_rows(terrain.terrain_width, terrain.terrain_height // 2)
+        terrain.set_tiles(slice(None), lower_half, below)
+
+        # start preparing the chunks that go on top of it
+        the_spawner = self.world.component_for_entity(spawner, Spawner)
+        if self.library is not None:
+            # replay the library's episodes in turn
+            library_episode = self.episode % len(self.library)
+            self.episode_seed = self.library.seed(library_episode)
+            chunks = self.library.chunks(library_episode, self.generator, the_spawner)
+        else:
+            # every episode starts on a new terrain seed, unless one is set
+            if self.seed is None:
+                self.episode_seed = random.getrandbits(32)
+            else:
+                self.episode_seed = self.seed
+            chunks = self.generator.chunks(self.episode_seed, below, the_spawner, the_spawner.chunk_generation_count)
+        print("terrain seed = " + str(self.episode_seed))
+        self.episode += 1
+
+        self.producer.reset(chunks)
+        self.generate_chunk(terrain, self.producer.take())
+        terrain.refresh_visible()
+
+    # stops preparing chunks, for when the game shuts down
+    def close(self):
+        self.producer.close()
 
     def clearTerrain(self):
         for _, (terrain) in self.world.get_component(Terrain):
-            for x in range(COLUMNS):
-                for y in range(terrain.terrain_height):
-                    terrain.tile_matrix[x][y].set_tile_type(Tiles.WATER)
+            terrain.set_tiles(slice(None), slice(None), Tiles.WATER)
+            terrain.head = 0
             terrain.scroll_pos = terrain.terrain_height - 1
 
-    # TODO: Fix
-    # Should create a six tile wide path near the center of the screen, allowing the player to always
-    # Have somewhere to be
-    def carve(self, row, terrain):
-        for i in range(-3, 4):  # carve a six wide path
-            terrain.tile_matrix[self.carving_center + i][row].set_tile_type(Tiles.WATER)
-
-        self.carving_center += random.randint(-1, 1)
-        if (self.carving_center >= (terrain.terrain_width - 4)):
-            self.carving_center = terrain.terrain_width - 5
-        elif (self.carving_center <= 4):
-            self.carving_center = 5
-
-    # Scrolls and regenerates the terrain every ROWS rows
+    # Scrolls the terrain by one row, and regenerates it every ROWS rows
     def scroll(self, terrain):
-        self.current_delay += 1
-
-        if (self.current_delay >= terrain.scroll_delay):
-            #Check the shield status of the player
-            self.world.component_for_entity(player, Player).checkShieldStatus()
-
-            # print(terrain.scroll_pos)
-            terrain.scroll_pos -= 1
-            self.current_delay = 0
-            for ent, (pos) in self.world.get_component(Position):
-                pos.y += 1
-            player_pos = self.world.component_for_entity(player, Position)
-            player_pos.y -= 1
-            p = self.world.component_for_entity(player, Player)
-            p.defuel()  # defuel each time terrain scrolls
-            p.score += 1
+        #Check the shield status of the player
+        self.world.component_for_entity(player, Player).checkShieldStatus()
+
+        # print(terrain.scroll_pos)
+        terrain.scroll_pos -= 1
+        # shift every position down a row in one array operation
+        ys = self.world.array_store(Position).field('y')
+        ys += 1
+        player_pos = self.world.component_for_entity(player, Position)
+        player_pos.y -= 1
+        p = self.world.component_for_entity(player, Player)
+        p.defuel()  # defuel each time terrain scrolls
+        p.score += 1
 
         if (terrain.scroll_pos == ((terrain.terrain_height // 2) - 1)):
             # print("scroll_pos = " + str(terrain.scroll_pos) + "   ((terrain.terrain_height // 2) - 1) = " + str(((terrain.terrain_height // 2) - 1)))
-            # copy upper terrain down
-            for x in range(terrain.terrain_width):
-                for y in range(terrain.terrain_height // 2):  # 0 to 29
-                    terrain.tile_matrix[x][y + (terrain.terrain_height // 2)].set_tile_type(
-                        terrain.tile_matrix[x][y].tile_type)
-
-            # load new chunck into upper terrain
-            self.generate_chunk(terrain, self.generate_noise())
+            # the upper terrain becomes the lower terrain; the rows are a ring
+            # buffer, so nothing is copied and the on-screen tiles keep their colours
+            terrain.advance_chunk()
+
+            # load the next prepared chunck into upper terrain
+            self.generate_chunk(terrain, self.producer.take())
             # update scroll position
             terrain.scroll_pos = terrain.terrain_height - 1
 
-    # Populates the chunk using the generated noise map
-    def generate_chunk(self, terrain, noise_map):
-        for x in range(0, terrain.terrain_height // 2):  # 0 to 29
-            for y in range(0, terrain.terrain_width):  # 0 to 29
-                if x == 0 or x == (COLUMNS - 1):
-                    terrain.tile_matrix[x][y].set_tile_type(Tiles.LAND)
-                else:
-                    terrain.tile_matrix[x][y].set_tile_type(noise_map[y][x])
-        for y in range((terrain.terrain_height // 2) - 1, -1, -1):  # 29 to 0
-            self.carve(y, terrain)
+        # one new row came onto the screen
+        terrain.scroll_visible()
+
+    # Populates the upper terrain with a prepared chunk
+    def generate_chunk(self, terrain, chunk):
+        terrain.set_tiles(slice(None), slice(0, terrain.terrain_height // 2), chunk.tiles, chunk.shades, chunk.spans)
 
         # spawn in enemies in the new chunk
-        self.world.get_processor(SpawnSystem).spawnEnemies()
-
-    # Initializes the noise map lists and then simulates the automata
-    def generate_noise(self):
-        noise_map = []
-        for i in range(0, COLUMNS):
-            noise_map.append([])
-        for x in noise_map:
-            for y in range(0, ROWS):
-                x.append(Tiles.WATER)
-
-        noise_map = self.initialize_map(noise_map)
-
-        for i in range(self.generation_steps):
-            noise_map = self.sim_step(noise_map)
-
-        return noise_map
-
-    # Steps through the simulation, counting, killing, and rebirthing neighboring cells
-    # for every cell in the noise map.
-    def sim_step(self, old_noise_map):
-        new_noise_map = []
-        for _ in range(0, COLUMNS):
-            new_noise_map.append([])
-        for x in new_noise_map:
-            for y in range(0, ROWS):
-                x.append(Tiles.WATER)
-
-        for x in range(0, COLUMNS):
-            for y in range(0, ROWS):
-                neighbors = self.count_live_neighbors(old_noise_map, x, y)
-                if (old_noise_map[x][y] == Tiles.LAND):
-                    if (neighbors < self.neighbors_for_murder):
-                        new_noise_map[x][y] = Tiles.WATER
-                    else:
-                        new_noise_map[x][y] = Tiles.LAND
-                else:
-                    if (neighbors > self.neighbors_for_rebirth):
-                        new_noise_map[x][y] = Tiles.LAND
-                    else:
-                        new_noise_map[x][y] = Tiles.WATER
-
-        return new_noise_map
-
-    # TODO: Check to see if actual behavior matches intended behavior.
-    # Simply counts the number of nearby cells that are alive.
-    # Counts cells over the edge as alive, leading to more land on the sides.
-    def count_live_neighbors(self, noise_map, x, y):
-        count = 0
-        for i in range(-1, 2):
-            for j in range(-1, 2):
-                neighbor_x = x + i
-                neighbor_y = y + j
-
-                if (
-                                i == 0 and j == 0):  # don't do anything if you are looking at the cell whose neighbors you want to count
-                    pass
-                elif (
-                                neighbor_x < 0 or neighbor_x >= COLUMNS):  # if cell has no above neighbors or below neighbors count those non-existance neighbors as dead
-                    count += 0
-                elif (
-                                neighbor_y < 0 or neighbor_y >= ROWS):  # if cell has no right/left neighbors, count them as living
-                    count += 1
-                elif (noise_map[neighbor_x][
-                          neighbor_y] == Tiles.LAND):  # if neighbor is alive, increase living neighbor count
-                    count += 1
-
-        return count
-
-    # Randomly decides if each cell starts as alive or dead
-    def initialize_map(self, noise_map):
-        for x in range(0, COLUMNS):
-            for y in range(0, ROWS):
-                if (random.random() < self.start_alive_prob):
-                    noise_map[x][y] = Tiles.LAND
-
-        return noise_map
+        self.world.get_processor(SpawnSystem).spawnEnemies(chunk)
 
 
 # TODO: Refactor enemies to use new tile system. Also refactor into components and systems.
 # TODOCONT: Logic goes in systems, state in components.
 
 
-world = esper.World()
+world = esper.World(timed=PROFILE_SYSTEMS, archetypes=True)
+
+# Keep the numeric fields of the hot components in dense NumPy columns, so
+# systems can update all of them with a single array operation.
+world.register_array_component(Position, 'x', 'y')
+world.register_array_component(Velocity, 'x', 'y')
+world.register_array_component(Bullet, 'x', 'y', 'last_x', 'last_y', 'x_vel', 'y_vel', 'lifespan', 'time_alive')
+world.register_array_component(EnemyBullet, 'x', 'y', 'last_x', 'last_y', 'x_vel', 'y_vel', 'lifespan', 'time_alive')
 
 # Create the player entity. Has a position, velocity, collider, it can be rendered,
 # and it has special player logic and state.
 player = world.create_entity(
-    Position(14, 27),
+    Position(PLAYER_START_POS_X, PLAYER_START_POS_Y),
     Player(3, 100, 100, 0.5),
     Velocity(0, 0),
-    Renderable(pygame.image.load("./images/plane.png")),
+    Renderable(load_sprite("./images/plane.png")),
     Collider(1, 1)
 )
 
@@ -1319,7 +1342,7 @@ player = world.create_entity(
 
 # Create the terrain entity. Simply has Terrain component.
 terrain = world.create_entity(
-    Terrain()
+    Terrain(TERRAIN_SCROLL_DELAY, COLUMNS, ROWS * 2)
 )
 
 spawner = world.create_entity(
@@ -1340,8 +1363,9 @@ enemy_system = EnemySystem()
 # Adds the systems to the world. The priority argument is optional, higher values are
 # higher priority. Defaults to 0.
 world.add_processor(render_system, 1)
-world.add_processor(bullet_system, 2)
-world.add_processor(collider_system, 3)
+# the collider system runs after everything has moved, bullets included
+world.add_processor(collider_system, 2)
+world.add_processor(bullet_system, 3)
 world.add_processor(movement_system, 4)
 world.add_processor(spawn_system, 5)
 world.add_processor(terrain_system, 6)
@@ -1366,6 +1390,7 @@ while run:
         win.blit(image, (0, 0))
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                terrain_system.close()
                 pygame.quit()
                 sys.exit()
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -1438,68 +1463,72 @@ while run:
 
         if count == 0:
             print(moves)
-            # create a collider for all on-screen land tiles ...
+            # mark all on-screen tiles as land, then fill in the water spans of each row
+            the_terrain = world.component_for_entity(terrain, Terrain)
             land_print = []
-            for i in reversed(range(30)):
-                index = 29 - i
-                land_print.append([])
-                for j in range(30):
-                    if world.component_for_entity(terrain, Terrain).tile_matrix[j][world.component_for_entity(terrain, Terrain).get_scroll() - (i+1)].tile_type == Tiles.LAND:
-                        land_print[index].append(["L", 1, 0])
-                    else:
-                        land_print[index].append(["W", 1, 0])
+            row_spans = []
+            for i in reversed(range(ROWS)):
+                spans = the_terrain.row_spans(the_terrain.get_scroll() - (i+1))
+                row = [["L", 1, 0]] * COLUMNS
+                for start, end in spans:
+                    row[start:end] = [["W", 1, 0]] * (end - start)
+                land_print.append(row)
+                row_spans.append(spans)
 
             for ent, (pos, render, fs) in world.get_components(Position, Renderable, FuelStrip):
                 # print("FUEL: " + str(pos.x) + ", " + str(pos.y))
-                if pos.y >= 0 and pos.y <= 29 and pos.x >= 0 and pos.x <= 29:
+                if 0 <= pos.y < ROWS and 0 <= pos.x < COLUMNS:
                     land_print[pos.y][pos.x] = ["F", 1, 0]
-                    if pos.y < 29:
+                    if pos.y < ROWS - 1:
                         land_print[pos.y+1][pos.x] = ["F", 1, 0]
 
             for ent, (heli, pos, vel) in world.get_components(Helicopter, Position, Velocity):
                 # print("HELI: " + str(pos.x) + ", " + str(pos.y) + ", " + str(vel.x) + ", " + str(vel.y))
-                if pos.y >= 0 and pos.y <= 29 and pos.x >= 0 and pos.x <= 29:
+                if 0 <= pos.y < ROWS and 0 <= pos.x < COLUMNS:
                     land_print[pos.y][pos.x] = ["H", 1+vel.y, vel.x]
 
             for ent, (jet, pos, vel) in world.get_components(Jet, Position, Velocity):
                 # print("JET: " + str(pos.x) + ", " + str(pos.y) + ", " + str(vel.x) + ", " + str(vel.y))
-                if pos.y >= 0 and pos.y <= 29 and pos.x >= 0 and pos.x <= 29:
+                if 0 <= pos.y < ROWS and 0 <= pos.x < COLUMNS:
                     land_print[pos.y][pos.x] = ["J", 1+vel.y, vel.x]
 
             for ent, (boat, pos, vel) in world.get_components(Boat, Position, Velocity):
                 # print("BOAT: " + str(pos.x) + ", " + str(pos.y) + ", " + str(vel.x) + ", " + str(vel.y))
-                if pos.y >= 0 and pos.y <= 29 and pos.x >= 0 and pos.x <= 29:
+                if 0 <= pos.y < ROWS and 0 <= pos.x < COLUMNS:
                     land_print[pos.y][pos.x] = ["Bt", 1+vel.y, vel.x]
-                    land_print[pos.y][pos.x+1] = ["Bt", 1+vel.y, vel.x]
+                    if pos.x < COLUMNS - 1:
+                        land_print[pos.y][pos.x+1] = ["Bt", 1+vel.y, vel.x]
 
             for ent, (shield, pos) in world.get_components(ShieldPickup, Position):
-                if pos.y >= 0 and pos.y <= 29 and pos.x >= 0 and pos.x <= 29:
+                if 0 <= pos.y < ROWS and 0 <= pos.x < COLUMNS:
                     land_print[pos.y][pos.x] = ["S", 1, 0]
 
             for bullet_ent, bullet in world.get_component(Bullet):
                 # print("BULLET: " + str(bullet.x) + ", " + str(bullet.y))
-                if bullet.y >= 0 and bullet.y <= 29 and bullet.x >= 0 and bullet.x <= 29:
+                if 0 <= bullet.y < ROWS and 0 <= bullet.x < COLUMNS:
                     land_print[bullet.y][bullet.x] = ["BP", bullet.y_vel, bullet.x_vel]
 
             for bullet_ent, bullet in world.get_component(EnemyBullet):
                 # print("BULLET: " + str(bullet.x) + ", " + str(bullet.y))
-                if bullet.y >= 0 and bullet.y <= 29 and bullet.x >= 0 and bullet.x <= 29:
+                if 0 <= bullet.y < ROWS and 0 <= bullet.x < COLUMNS:
                     land_print[bullet.y][bullet.x] = ["BE", bullet.y_vel, bullet.x_vel]
 
             for ent, (pos, render, br) in world.get_components(Position, Renderable, Bridge):
                 # print("BRIDGE: " + str(pos.x) + ", " + str(pos.y))
-                if pos.y >= 0 and pos.y <= 29 and pos.x >= 0 and pos.x <= 29:
-                    for i in range(30):
+                if 0 <= pos.y < ROWS and 0 <= pos.x < COLUMNS:
+                    for i in range(COLUMNS):
                         land_print[pos.y][i] = ["Br", 1, 0]
-                        if pos.y < 29:
+                        if pos.y < ROWS - 1:
                             land_print[pos.y+1][i] = ["Br", 1, 0]
 
             for ent, (p, pos) in world.get_components(Player, Position):
                 land_print[pos.y][pos.x] = "P"
                 land_print.append([["P", pos.y, pos.x], p.lives, p.fuel, p.shieldsAvailable])
+            if OBSERVATION_SPANS:
+                land_print.append(["WS", row_spans])
 
             print(land_print)
-            print(land_print[15])
+            print(land_print[ROWS // 2])
             message = str(land_print)
             frame = 0
         count += 1
@@ -1547,5 +1576,10 @@ while run:
 
 
 
+if PROFILE_SYSTEMS:
+    world.export_timings(PROFILE_OUTPUT)
+
+terrain_system.close()
+
 # If we're no longer running, quit() pygame to free its resources.
 pygame.quit()
@@ -0,0 +1,638 @@
+import queue
+import random
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from enum import IntEnum
+
+import numpy as np
+
+# chunk caches report their statistics like the World's query cache does
+from esper import CacheInfo
+
+
+# Tile codes stored in terrain grids
+class Tiles(IntEnum):
+    WATER = 0
+    LAND = 1
+
+
+# Terrain Component
+class Terrain:
+    """The scrolling terrain, stored as arrays of tile codes and shades, an
+    index of the water spans in every row, and a land bitmap of the screen.
+
+    The arrays hold the Tiles code of every tile and the brightness of its
+    colour channel (green for land, blue for water), picked at random when
+    the tile is set. Rows are stored as a ring buffer: terrain row y lives in
+    array row `(y + head) % terrain_height`, so moving the upper half of the
+    map down to the lower half is just a move of the head. Use set_tiles
+    rather than writing to the arrays directly.
+    """
+    lower_bound_land = 200
+    upper_bound_land = 220
+
+    lower_bound_water = 240
+    upper_bound_water = 250
+
+    def __init__(self, scroll_delay, terrain_width, terrain_height):
+        # Frames per scroll
+        self.scroll_delay = scroll_delay
+        # Width in tiles
+        self.terrain_width = terrain_width
+        # Height in tiles
+        self.terrain_height = terrain_height
+
+        self.tiles = np.full((terrain_width, terrain_height), Tiles.WATER, dtype=np.uint8)
+        self.shades = np.zeros((terrain_width, terrain_height), dtype=np.uint8)
+        # Array row holding terrain row 0
+        self.head = 0
+        self.shades[:] = roll_shades(self.tiles)
+        # The water spans of each array row, see water_spans
+        self.spans = water_spans(self.tiles)
+        # Land bitmap of the rows on screen, indexed by screen column and row
+        self.visible_land = np.zeros((terrain_width, terrain_height // 2), dtype=bool)
+
+        self.scroll_pos = terrain_height - 1
+
+        self.initialized = False
+        # Bumped whenever tiles are set or the head moves, so that anything
+        # drawn from the tiles knows when to redraw
+        self.version = 0
+
+    def get_scroll(self):
+        return self.scroll_pos
+
+    def set_tiles(self, xs, ys, tile_types, shades=None, spans=None):
+        """Set a block of tiles, and their colours.
+
+        The water spans of the rows are rebuilt to match.
+
+        :param xs: Column index or slice.
+        :param ys: Row index or slice.
+        :param tile_types: A Tiles code, or an array of codes that fits the block.
+        :param shades: Shades for the block, see roll_shades. New random
+        shades are picked if this is None.
+        :param spans: The water spans of the rows, if they are known already.
+        They must cover whole rows, see water_spans.
+        """
+        rows = np.atleast_1d(self._rows(ys))
+        self.tiles[xs, rows] = tile_types
+        if shades is None:
+            shades = roll_shades(self.tiles[xs, rows])
+        self.shades[xs, rows] = shades
+        if spans is None:
+            spans = water_spans(self.tiles[:, rows])
+        for row, span in zip(rows.tolist(), spans):
+            self.spans[row] = span
+        self.version += 1
+
+    def refresh_visible(self):
+        """Rebuild the land bitmap of the screen from the tiles."""
+        top = self.scroll_pos - self.terrain_height // 2
+        self.visible_land[:] = self.tiles[:, self._rows(slice(top, self.scroll_pos))] == Tiles.LAND
+
+    def scroll_visible(self):
+        """Update the land bitmap of the screen after the terrain scrolled by one row.
+
+        Everything moves down a row, and only the new top row is read from the tiles.
+        """
+        top = self.scroll_pos - self.terrain_height // 2
+        self.visible_land[:, 1:] = self.visible_land[:, :-1]
+        self.visible_land[:, 0] = self.tiles[:, self._rows(top)] == Tiles.LAND
+
+    def land_on_screen(self, x, y):
+        """Check if the tile at screen column x and row y is land. Tiles off the screen are not."""
+        columns, rows = self.visible_land.shape
+        return 0 <= x < columns and 0 <= y < rows and bool(self.visible_land[x, y])
+
+    def screen_has_land(self, left, right, top, bottom):
+        """Check if there is land in a block of on-screen tiles.
+
+        The block is clipped to the screen, so only the part of it on screen counts.
+
+        :param left: First screen column of the block.
+        :param right: Column after the last one.
+        :param top: First screen row of the block.
+        :param bottom: Row after the last one.
+        """
+        columns, rows = self.visible_land.shape
+        left = max(left, 0)
+        top = max(top, 0)
+        right = min(right, columns)
+        bottom = min(bottom, rows)
+        # negative ends would wrap around the slices, so an empty block is checked first
+        if left >= right or top >= bottom:
+            return False
+        return bool(self.visible_land[left:right, top:bottom].any())
+
+    def row_spans(self, y):
+        """Get the water spans of terrain row y, as a list of (start, end) pairs."""
+        starts, ends = self.spans[(y + self.head) % self.terrain_height]
+        return list(zip(starts, ends))
+
+    def advance_chunk(self):
+        """Make the upper half of the terrain the lower half.
+
+        Only the head moves, so the tiles keep their colours. The upper half
+        then holds the old lower half, ready to be overwritten by a new chunk.
+        """
+        self.head = (self.head + self.terrain_height // 2) % self.terrain_height
+        self.version += 1
+
+    def colors(self, top, bottom):
+        """Get the RGB colours of rows top to bottom (exclusive), for every column.
+
+        :return: A (terrain_width, bottom - top, 3) uint8 array.
+        """
+        rows = self._rows(slice(top, bottom))
+        codes = self.tiles[:, rows]
+        shades = self.shades[:, rows]
+        rgb = np.zeros(codes.shape + (3,), dtype=np.uint8)
+        rgb[..., 1] = np.where(codes == Tiles.LAND, shades, 0)
+        rgb[..., 2] = np.where(codes == Tiles.WATER, shades, 0)
+        return rgb
+
+    def _rows(self, ys):
+        """Map a terrain row index or slice to rows of the ring buffer."""
+        if isinstance(ys, slice):
+            ys = np.arange(*ys.indices(self.terrain_height))
+        return (ys + self.head) % self.terrain_height
+
+
+def roll_shades(codes, rng=np.random):
+    """Pick a random colour shade for every tile, based on its type.
+
+    :param codes: Tiles codes, as a single code or an array.
+    :param rng: A numpy RandomState, or the numpy.random module.
+    :return: A uint8 array of shades, the same shape as *codes*.
+    """
+    land = rng.randint(Terrain.lower_bound_land, Terrain.upper_bound_land + 1, size=np.shape(codes))
+    water = rng.randint(Terrain.lower_bound_water, Terrain.upper_bound_water + 1, size=np.shape(codes))
+    return np.where(np.equal(codes, Tiles.LAND), land, water).astype(np.uint8)
+
+
+def water_spans(tiles):
+    """Find the spans of water in every row of a grid.
+
+    :param tiles: A (columns, rows) grid of tile codes.
+    :return: A list with a (starts, ends) pair of lists for every row. Water
+    runs from starts[i] up to, but not including, ends[i], and the starts are
+    in order so they can be searched with bisect.
+    """
+    columns, rows = tiles.shape
+    water = np.zeros((rows, columns + 2), dtype=np.int8)
+    water[:, 1:-1] = (tiles == Tiles.WATER).T
+    edges = np.diff(water, axis=1)
+    spans = [([], []) for _ in range(rows)]
+    # nonzero goes row by row, left to right, so every list comes out in order
+    for row, column in zip(*np.nonzero(edges == 1)):
+        spans[row][0].append(int(column))
+    for row, column in zip(*np.nonzero(edges == -1)):
+        spans[row][1].append(int(column))
+    return spans
+
+
+def span_covers(span, left, right):
+    """Check if one row's water spans cover every column from left up to right."""
+    starts, ends = span
+    i = bisect_right(starts, left) - 1
+    return i >= 0 and right <= ends[i]
+
+
+def chunk_rng(seed, index):
+    """Get the random number generator for one chunk of terrain.
+
+    Every (seed, index) pair gets its own stream, so a chunk always comes out
+    the same, whichever chunks were generated before it and on whichever thread.
+
+    :param seed: The terrain seed of the episode.
+    :param index: The number of the chunk in the episode.
+    :return: A random.Random instance.
+    """
+    return random.Random("%d/%d" % (seed, index))
+
+
+class ChunkCache:
+    """A bounded, least recently used cache of generated chunks.
+
+    Chunks are keyed by the (seed, index) pair they were generated from, so
+    episodes replayed on the same seed can reuse them instead of generating
+    them again.
+
+    :param maxsize: How many chunks to keep.
+    """
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def get(self, seed, index):
+        """Get a cached chunk, or None if it is not cached."""
+        with self._lock:
+            chunk = self._chunks.get((seed, index))
+            if chunk is None:
+                self.misses += 1
+                return None
+            self._chunks.move_to_end((seed, index))
+            self.hits += 1
+            return chunk
+
+    def put(self, seed, index, chunk):
+        """Cache a chunk, evicting the least recently used one if full."""
+        with self._lock:
+            self._chunks[(seed, index)] = chunk
+            self._chunks.move_to_end((seed, index))
+            while len(self._chunks) > self.maxsize:
+                self._chunks.popitem(last=False)
+
+    def clear(self):
+        """Remove every cached chunk, and reset the statistics."""
+        with self._lock:
+            self._chunks.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self):
+        """Report the cache statistics.
+
+        :return: A CacheInfo named tuple of (hits, misses, maxsize, currsize),
+        in the same form as `functools.lru_cache`.
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._chunks))
+
+
+def initialize_map(columns, rows, start_alive_prob, rand=random.random):
+    """Randomly decide if each cell of a new noise map starts as land.
+
+    The cells are drawn in the same column-major order as the original
+    per-cell generator, so the same seed gives the same map.
+
+    :param columns: Width of the map, in tiles.
+    :param rows: Height of the map, in tiles.
+    :param start_alive_prob: Chance of each cell starting as land.
+    :param rand: Function returning a random float in [0, 1).
+    :return: A (columns, rows) uint8 grid of tile codes.
+    """
+    count = columns * rows
+    draws = np.fromiter((rand() for _ in range(count)), dtype=np.float64, count=count)
+    return (draws.reshape(columns, rows) < start_alive_prob).astype(np.uint8)
+
+
+def count_live_neighbors(grid):
+    """Count the land neighbours of every cell at once.
+
+    Cells past the left or right edge count as water, and cells past the
+    top or bottom edge count as land, which leads to more land on the
+    sides. Corner cells that are past both edges count as water.
+
+    :param grid: A (columns, rows) uint8 grid of tile codes.
+    :return: A (columns, rows) uint8 grid of neighbour counts.
+    """
+    columns, rows = grid.shape
+    padded = np.pad(grid, ((0, 0), (1, 1)), constant_values=Tiles.LAND)
+    padded = np.pad(padded, ((1, 1), (0, 0)), constant_values=Tiles.WATER)
+
+    counts = np.zeros(grid.shape, dtype=np.uint8)
+    for dx in range(3):
+        for dy in range(3):
+            if dx != 1 or dy != 1:
+                counts += padded[dx:dx + columns, dy:dy + rows]
+    return counts
+
+
+def sim_step(grid, neighbors_for_murder, neighbors_for_rebirth):
+    """Advance the cellular automaton by one step.
+
+    Land with fewer than *neighbors_for_murder* land neighbours becomes
+    water, and water with more than *neighbors_for_rebirth* land neighbours
+    becomes land.
+
+    :param grid: A (columns, rows) uint8 grid of tile codes.
+    :return: A new grid of the same shape.
+    """
+    neighbors = count_live_neighbors(grid)
+    survives = neighbors >= neighbors_for_murder
+    reborn = neighbors > neighbors_for_rebirth
+    return np.where(grid == Tiles.LAND, survives, reborn).astype(np.uint8)
+
+
+def generate_noise(columns, rows, generation_steps, neighbors_for_murder, neighbors_for_rebirth,
+                   start_alive_prob, rand=random.random):
+    """Generate a cellular automaton noise map.
+
+    :return: A (columns, rows) uint8 grid of tile codes.
+    """
+    grid = initialize_map(columns, rows, start_alive_prob, rand)
+    for _ in range(generation_steps):
+        grid = sim_step(grid, neighbors_for_murder, neighbors_for_rebirth)
+    return grid
+
+
+def initial_rows(columns, rows):
+    """Get the terrain an episode starts on: open water with land on both sides.
+
+    :return: A (columns, rows) uint8 grid of tile codes.
+    """
+    tiles = np.full((columns, rows), Tiles.WATER, dtype=np.uint8)
+    tiles[:3, :] = Tiles.LAND
+    tiles[columns - 3:, :] = Tiles.LAND
+    return tiles
+
+
+def land_collision(spans, columns, x, y, width, height):
+    """Check if a width x height block at (x, y) would be on land.
+
+    Hanging off the right side counts as hitting land, and rows past the
+    bottom are not checked.
+
+    :param spans: The water spans of every row, see water_spans.
+    :param columns: Width of the rows, in tiles.
+    """
+    if x + width > columns:
+        return True
+    for span in spans[y:y + height]:
+        if not span_covers(span, x, x + width):
+            return True
+    return False
+
+
+# Kinds of spawns a chunk can plan, and the number of arguments each one takes
+SPAWN_KINDS = ('boat', 'heli', 'jet', 'enhanced_heli', 'fuel_strip', 'bridge', 'shield_pickup')
+SPAWN_ARGS = {'boat': 2, 'heli': 3, 'jet': 2, 'enhanced_heli': 2, 'fuel_strip': 2, 'bridge': 0, 'shield_pickup': 2}
+
+
+class SpawnRules:
+    """The rules for what spawns in each new chunk.
+
+    The defaults match the game. Sizes are in tiles, and are used to keep
+    spawns off land.
+    """
+    def __init__(self):
+        self.enemy_type_count = 4
+        self.initial_spawn_attempts = 4
+        self.chunks_required_to_increase_spawn_attempts = 2  # spawn attempts will after this many new chunks have been generated
+        self.fuel_strip_spawn_attempts = 3
+        self.chunks_before_shield_spawn_attempt = 4
+        self.boat_size = (2, 1)
+        self.heli_size = (2, 1)
+        self.fuel_strip_size = (1, 2)
+        self.shield_pickup_size = (1, 2)
+
+    def enemy_spawn_attempts(self, chunk_count):
+        """Get how many enemies to try to spawn in the chunk numbered chunk_count."""
+        return (chunk_count // self.chunks_required_to_increase_spawn_attempts) + self.initial_spawn_attempts
+
+    def plan(self, spans, terrain_width, terrain_height, chunk_count, rng):
+        """Plan what to spawn in a new chunk.
+
+        :param spans: The water spans of the chunk's rows, followed by those
+        of the rows below it.
+        :param terrain_width: Width of the chunk, in tiles.
+        :param terrain_height: Height of the chunk, in tiles.
+        :param chunk_count: The number of the chunk in its episode.
+        :param rng: A random.Random to roll the spawns with.
+        :return: A list of (kind, args...) tuples, see SPAWN_KINDS.
+        """
+        spawns = []
+
+        # spawn enemies, if they will not spawn on land
+        for i in range(self.enemy_spawn_attempts(chunk_count)):
+            randomX = rng.randint(0, terrain_width)
+            randomY = rng.randint(0, terrain_height)
+
+            randomNumber = rng.randint(1, self.enemy_type_count)
+
+            if (randomNumber == 1):
+                if (not land_collision(spans, terrain_width, randomX, randomY, *self.boat_size)):
+                    spawns.append(('boat', randomX, randomY))
+            elif (randomNumber == 2):
+                if (not land_collision(spans, terrain_width, randomX, randomY, *self.heli_size)):
+                    spawns.append(('heli', randomX, randomY, rng.randint(5, 20)))
+            elif (randomNumber == 3):
+                spawns.append(('jet', randomX, randomY))
+            elif (randomNumber == 4):
+                if (randomX > terrain_width / 2):  # spawn heli on left side
+                    spawns.append(('enhanced_heli', terrain_width, randomY))
+                if (randomX <= terrain_width / 2):  # spawn heli on right side
+                    spawns.append(('enhanced_heli', 0, randomY))
+
+        # spawn fuel strips
+        for i in range(self.fuel_strip_spawn_attempts):
+            randomX = rng.randint(0, terrain_width)
+            randomY = rng.randint(0, terrain_height)
+            if (not land_collision(spans, terrain_width, randomX, randomY, *self.fuel_strip_size)):
+                spawns.append(('fuel_strip', randomX, randomY))
+
+        # spawn bridges
+        if (rng.randint(0, 3) == 0):
+            spawns.append(('bridge',))
+
+        # spawn shields
+        if (chunk_count % self.chunks_before_shield_spawn_attempt == 0):
+            randomX = rng.randint(0, terrain_width)
+            randomY = rng.randint(0, terrain_height)
+            if (not land_collision(spans, terrain_width, randomX, randomY, *self.shield_pickup_size)):
+                spawns.append(('shield_pickup', randomX, randomY))
+
+        return spawns
+
+
+class Chunk:
+    """One generated chunk of terrain, ready to be loaded.
+
+    :param index: The number of the chunk in its episode, counting from 1.
+    :param tiles: A (columns, rows) uint8 grid of tile codes.
+    :param shades: A (columns, rows) uint8 grid of tile shades.
+    :param spawns: The planned spawns, see SpawnRules.plan.
+    :param carving_center: Where the carved path of the next chunk starts.
+    :param spans: The water spans of the rows, found from the tiles if None.
+    """
+    def __init__(self, index, tiles, shades, spawns, carving_center, spans=None):
+        self.index = index
+        self.tiles = tiles
+        self.shades = shades
+        self.spawns = spawns
+        self.carving_center = carving_center
+        self.spans = water_spans(tiles) if spans is None else spans
+
+
+class ChunkGenerator:
+    """Generates the chunks of terrain that scroll onto the screen.
+
+    Each chunk is a cellular automaton noise map with land down both sides
+    and a river path carved through it. The path carries on from the chunk
+    before, and spawns are kept off the land of the chunk and of the rows
+    below it. All the random numbers for a chunk come from
+    chunk_rng(seed, index), so an episode's chunks only depend on its seed.
+
+    :param columns: Width of a chunk, in tiles.
+    :param rows: Height of a chunk, in tiles.
+    :param carving_center: Column the path starts from. Defaults to the middle.
+    :param cache: An optional ChunkCache to reuse chunks from.
+    """
+    def __init__(self, columns, rows, carving_center=None, generation_steps=6, neighbors_for_murder=4,
+                 neighbors_for_rebirth=3, start_alive_prob=0.35, cache=None):
+        self.columns = columns
+        self.rows = rows
+        self.carving_center = columns // 2 if carving_center is None else carving_center
+        # Cellular Automata Parameters
+        self.generation_steps = generation_steps
+        self.neighbors_for_murder = neighbors_for_murder
+        self.neighbors_for_rebirth = neighbors_for_rebirth
+        self.start_alive_prob = start_alive_prob
+        self.cache = cache
+
+    def chunks(self, seed, below, rules, chunk_count=0, carving_center=None):
+        """Generate the chunks of an episode, one after another.
+
+        :param seed: The terrain seed of the episode.
+        :param below: The (columns, rows) tiles the first chunk goes on top of.
+        :param rules: The SpawnRules to plan spawns with.
+        :param chunk_count: How many chunks came before the first one.
+        :param carving_center: Column the path starts from, if not the default.
+        :return: An endless generator of Chunks.
+        """
+        if carving_center is None:
+            carving_center = self.carving_center
+        below_spans = water_spans(below)
+        while True:
+            chunk_count += 1
+            chunk = None if self.cache is None else self.cache.get(seed, chunk_count)
+            if chunk is None:
+                chunk = self.build_chunk(chunk_rng(seed, chunk_count), chunk_count, below_spans, carving_center, rules)
+                if self.cache is not None:
+                    self.cache.put(seed, chunk_count, chunk)
+            yield chunk
+            below_spans = chunk.spans
+            carving_center = chunk.carving_center
+
+    def build_chunk(self, rng, chunk_count, below_spans, carving_center, rules):
+        """Generate one chunk, taking all of its random numbers from rng.
+
+        :param below_spans: The water spans of the rows below the chunk.
+        """
+        # the noise map is laid on its side, so its land-favouring edges end up
+        # on the sides of the river; the outermost columns are always land
+        tiles = self.generate_noise(rng).T.copy()
+        tiles[0, :] = Tiles.LAND
+        tiles[self.columns - 1, :] = Tiles.LAND
+        for y in range(self.rows - 1, -1, -1):  # bottom to top
+            carving_center = self.carve(y, tiles, carving_center, rng)
+
+        spans = water_spans(tiles)
+        spawns = rules.plan(spans + below_spans, self.columns, self.rows, chunk_count, rng)
+        shades = roll_shades(tiles, np.random.RandomState(rng.getrandbits(32)))
+        return Chunk(chunk_count, tiles, shades, spawns, carving_center, spans)
+
+    def carve(self, row, tiles, carving_center, rng):
+        """Carve a six tile wide path across one row, near the center of the screen.
+
+        This makes sure the player always has somewhere to be.
+
+        :return: Where to carve the next row.
+        """
+        # a negative start would wrap around the slice, and carve nothing
+        tiles[max(carving_center - 3, 0):carving_center + 4, row] = Tiles.WATER
+
+        carving_center += rng.randint(-1, 1)
+        if (carving_center >= (self.columns - 4)):
+            carving_center = self.columns - 5
+        elif (carving_center <= 4):
+            carving_center = 5
+        return carving_center
+
+    def generate_noise(self, rng=random):
+        """Generate a rows x columns noise map, see generate_noise."""
+        return generate_noise(self.rows, self.columns,
+                              self.generation_steps,
+                              self.neighbors_for_murder,
+                              self.neighbors_for_rebirth,
+                              self.start_alive_prob,
+                              rng.random)
+
+
+class ChunkProducer:
+    """Prepares upcoming terrain chunks ahead of time on a worker thread.
+
+    The chunks come from an iterator, usually a generator, which is advanced
+    on the worker thread only, so it must not touch any state the game
+    thread changes. Up to *depth* prepared chunks are kept ready. Call close
+    when done with it, to stop the worker thread.
+
+    :param depth: How many prepared chunks to keep ready.
+    """
+    def __init__(self, depth=2):
+        self._ready = queue.Queue(maxsize=depth)
+        self._lock = threading.Condition()
+        # Bumped on every reset, so chunks made before it can be told apart
+        self._epoch = 0
+        self._chunks = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ChunkProducer', daemon=True)
+        self._thread.start()
+
+    def reset(self, chunks):
+        """Throw away the prepared chunks, and start preparing new ones.
+
+        :param chunks: An iterator of the chunks to prepare, in order.
+        """
+        with self._lock:
+            self._epoch += 1
+            self._chunks = chunks
+            self._lock.notify()
+        self._drain()
+
+    def close(self):
+        """Stop the worker thread, and wait for it to finish the chunk it is on."""
+        with self._lock:
+            self._stopped.set()
+            self._chunks = None
+            self._lock.notify()
+        # a worker waiting for room in the queue gets it, then sees the stop
+        self._drain()
+        self._thread.join()
+
+    def _drain(self):
+        while True:
+            try:
+                self._ready.get_nowait()
+            except queue.Empty:
+                break
+
+    def take(self):
+        """Get the next prepared chunk, waiting for it if it is not ready yet.
+
+        An exception raised while preparing the chunk is raised here instead.
+        """
+        while True:
+            epoch, chunk = self._ready.get()
+            if epoch != self._epoch:
+                # prepared before the last reset
+                continue
+            if isinstance(chunk, Exception):
+                raise chunk
+            return chunk
+
+    def _run(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                while self._chunks is None and not self._stopped.is_set():
+                    self._lock.wait()
+                if self._stopped.is_set():
+                    break
+                epoch, chunks = self._epoch, self._chunks
+            try:
+                chunk = next(chunks)
+            except Exception as error:
+                # hand the error over to take(), and wait for the next reset
+                chunk = error
+                with self._lock:
+                    if self._epoch == epoch:
+                        self._chunks = None
+            self._ready.put((epoch, chunk))
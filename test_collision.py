@@ -0,0 +1,50 @@
+"""Tests for the batched bullet checks in collision.
+
+    python -m unittest test_collision
+"""
+import unittest
+
+import numpy as np
+
+import collision
+
+
+def moves(*pairs):
+    """Split ((start_x, start_y), (x, y)) pairs into the four arrays path_steps takes."""
+    columns = np.array([start + end for start, end in pairs], dtype=np.int64).reshape(len(pairs), 4)
+    return tuple(columns.T)
+
+
+class PathsOverlapTest(unittest.TestCase):
+    # a player 2 tiles wide and 3 tall, at (10, 20)
+    box = (10, 20, 2, 3)
+
+    def test_every_tile_of_the_box_is_hit(self):
+        for x in range(10, 12):
+            for y in range(20, 23):
+                hit = collision.paths_overlap(*moves(((x, y + 1), (x, y))), *self.box)
+                self.assertTrue(hit[0], (x, y))
+
+    def test_tiles_beside_the_box_are_missed(self):
+        for x, y in ((9, 20), (12, 20), (10, 19), (11, 23)):
+            hit = collision.paths_overlap(*moves(((x, y), (x, y))), *self.box)
+            self.assertFalse(hit[0], (x, y))
+
+    def test_a_move_through_the_box_hits(self):
+        # goes from above the box to below it in one frame
+        hit = collision.paths_overlap(*moves(((11, 18), (11, 24)), ((13, 18), (13, 24))), *self.box)
+        np.testing.assert_array_equal(hit, [True, False])
+
+    def test_agrees_with_overlaps_path(self):
+        # horizontal, vertical and diagonal moves, which is all path_steps follows exactly
+        pairs = [((x0, y0), (x0 + dx * n, y0 + dy * n)) for x0 in range(8, 14) for y0 in range(18, 25)
+                 for dx in (-1, 0, 1) for dy in (-1, 0, 1) for n in (1, 2, 3)]
+        hit = collision.paths_overlap(*moves(*pairs), *self.box)
+        for i, ((x0, y0), (x1, y1)) in enumerate(pairs):
+            # traverse also covers the start tile, which path_steps leaves out of moves
+            expected = collision.overlaps_path(collision.traverse(x0, y0, x1, y1)[1:] or [(x0, y0)], *self.box) >= 0
+            self.assertEqual(hit[i], expected, pairs[i])
+
+
+if __name__ == '__main__':
+    unittest.main()
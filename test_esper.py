@@ -0,0 +1,144 @@
+"""Tests for the entity and Component bookkeeping in esper.
+
+    python -m unittest test_esper
+"""
+import threading
+import unittest
+
+import esper
+
+
+class Position:
+    def __init__(self, x=0, y=0):
+        self.x = x
+        self.y = y
+
+
+class Velocity:
+    def __init__(self, x=0, y=0):
+        self.x = x
+        self.y = y
+
+
+class Declared(esper.Processor):
+    def __init__(self, name, reads, writes, log=None):
+        self.name = name
+        self.reads = reads
+        self.writes = writes
+        self.log = log
+
+    def process(self):
+        if self.log is not None:
+            self.log(self.name)
+
+
+class DeadEntitiesTest(unittest.TestCase):
+    def test_stale_deletion_is_dropped(self):
+        world = esper.World()
+        entity = world.create_entity(Position())
+        world.delete_entity(entity, immediate=True)
+        # queued after the entity is already gone, so the id is stale
+        world.delete_entity(entity)
+        world.process()
+        self.assertEqual(world._dead_entities, set())
+        self.assertFalse(world.entity_exists(entity))
+
+    def test_stale_id_does_not_delete_its_reuse(self):
+        world = esper.World()
+        entity = world.create_entity(Position())
+        world.delete_entity(entity)
+        world.process()
+        reused = world.create_entity(Position())
+        world.delete_entity(entity)
+        world.process()
+        self.assertTrue(world.entity_exists(reused))
+        self.assertEqual(world._dead_entities, set())
+
+
+class ArrayComponentTest(unittest.TestCase):
+    def setUp(self):
+        self.world = esper.World()
+        self.world.register_array_component(Position, 'x', 'y')
+
+    def test_whole_numbers_are_stored(self):
+        entity = self.world.create_entity(Position(1, 2))
+        position = self.world.component_for_entity(entity, Position)
+        position.x += 1
+        position.y = 5.0
+        self.assertEqual((position.x, position.y), (2, 5))
+
+    def test_fractions_raise_instead_of_truncating(self):
+        entity = self.world.create_entity(Position(1, 2))
+        position = self.world.component_for_entity(entity, Position)
+        with self.assertRaises(ValueError):
+            position.x = 1.5
+        self.assertEqual(position.x, 1)
+
+    def test_a_component_that_does_not_fit_is_not_added(self):
+        entity = self.world.create_entity(Position(1, 2))
+        with self.assertRaises(ValueError):
+            self.world.add_component(entity, Position(0.5, 2))
+        with self.assertRaises(ValueError):
+            self.world.create_entity(Position(3, 0.25))
+        self.assertEqual([e for e, _ in self.world.get_component(Position)], [entity])
+        self.assertEqual(self.world.component_for_entity(entity, Position).x, 1)
+
+    def test_float_columns_keep_fractions(self):
+        world = esper.World()
+        world.register_array_component(Position, 'x', 'y', dtype='float64')
+        entity = world.create_entity(Position(0.5, 2))
+        position = world.component_for_entity(entity, Position)
+        position.y = 2.25
+        self.assertEqual((position.x, position.y), (0.5, 2.25))
+
+
+class ProcessorStagesTest(unittest.TestCase):
+    def add(self, world, *processors):
+        for priority, processor in enumerate(processors):
+            world.add_processor(processor, priority=len(processors) - priority)
+
+    def names(self, world):
+        return [[processor.name for processor in stage] for stage in world.processor_stages()]
+
+    def test_disjoint_processors_share_a_stage(self):
+        world = esper.World()
+        self.add(world,
+                 Declared('move', reads=(Velocity,), writes=(Position,)),
+                 Declared('steer', reads=(), writes=(Velocity,)),
+                 Declared('draw', reads=(Position,), writes=()),
+                 Declared('sound', reads=(), writes=()))
+        # steer writes what move reads, and draw reads what move writes
+        self.assertEqual(self.names(world), [['move', 'sound'], ['steer', 'draw']])
+
+    def test_readers_share_a_stage(self):
+        world = esper.World()
+        self.add(world,
+                 Declared('first', reads=(Position,), writes=()),
+                 Declared('second', reads=(Position, Velocity), writes=()),
+                 Declared('third', reads=(Velocity,), writes=()))
+        self.assertEqual(self.names(world), [['first', 'second', 'third']])
+
+    def test_undeclared_processors_run_alone(self):
+        world = esper.World()
+        self.add(world,
+                 Declared('before', reads=(), writes=()),
+                 Declared('anything', reads=None, writes=None),
+                 Declared('after', reads=(), writes=()))
+        self.assertEqual(self.names(world), [['before'], ['anything'], ['after']])
+
+    def test_a_stage_runs_concurrently(self):
+        # both processors wait for each other, so they only finish if they run at the same time
+        barrier = threading.Barrier(2, timeout=5)
+        log = []
+        world = esper.World(parallel=True, max_workers=2)
+        self.add(world,
+                 Declared('move', reads=(), writes=(Position,), log=lambda name: log.append((name, barrier.wait()))),
+                 Declared('steer', reads=(), writes=(Velocity,), log=lambda name: log.append((name, barrier.wait()))),
+                 Declared('draw', reads=(Position, Velocity), writes=(), log=log.append))
+        world.process()
+        self.assertEqual(sorted(name for name, _ in log[:2]), ['move', 'steer'])
+        self.assertEqual(log[2], 'draw')
+
+
+if __name__ == '__main__':
+    unittest.main()
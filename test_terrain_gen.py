@@ -0,0 +1,148 @@
+"""Tests for terrain_gen: parity of the NumPy cellular automaton, and the chunk producer.
+
+The reference functions below are the per-cell generator that terrain_gen
+replaced, kept as they were apart from taking the map size as arguments.
+
+    python -m unittest test_terrain_gen
+"""
+import itertools
+import random
+import unittest
+
+import numpy as np
+
+import terrain_gen
+
+WATER = 0
+LAND = 1
+
+
+def reference_initialize_map(columns, rows, start_alive_prob, rand):
+    noise_map = [[WATER] * rows for _ in range(columns)]
+    for x in range(0, columns):
+        for y in range(0, rows):
+            if (rand() < start_alive_prob):
+                noise_map[x][y] = LAND
+    return noise_map
+
+
+def reference_count_live_neighbors(noise_map, x, y):
+    columns = len(noise_map)
+    rows = len(noise_map[0])
+    count = 0
+    for i in range(-1, 2):
+        for j in range(-1, 2):
+            neighbor_x = x + i
+            neighbor_y = y + j
+            if (i == 0 and j == 0):
+                pass
+            elif (neighbor_x < 0 or neighbor_x >= columns):  # off-map columns are dead
+                count += 0
+            elif (neighbor_y < 0 or neighbor_y >= rows):  # off-map rows are alive
+                count += 1
+            elif (noise_map[neighbor_x][neighbor_y] == LAND):
+                count += 1
+    return count
+
+
+def reference_sim_step(old_noise_map, neighbors_for_murder, neighbors_for_rebirth):
+    columns = len(old_noise_map)
+    rows = len(old_noise_map[0])
+    new_noise_map = [[WATER] * rows for _ in range(columns)]
+    for x in range(0, columns):
+        for y in range(0, rows):
+            neighbors = reference_count_live_neighbors(old_noise_map, x, y)
+            if (old_noise_map[x][y] == LAND):
+                if (neighbors < neighbors_for_murder):
+                    new_noise_map[x][y] = WATER
+                else:
+                    new_noise_map[x][y] = LAND
+            else:
+                if (neighbors > neighbors_for_rebirth):
+                    new_noise_map[x][y] = LAND
+                else:
+                    new_noise_map[x][y] = WATER
+    return new_noise_map
+
+
+def reference_generate_noise(columns, rows, generation_steps, neighbors_for_murder, neighbors_for_rebirth,
+                             start_alive_prob, rand):
+    noise_map = reference_initialize_map(columns, rows, start_alive_prob, rand)
+    for _ in range(generation_steps):
+        noise_map = reference_sim_step(noise_map, neighbors_for_murder, neighbors_for_rebirth)
+    return noise_map
+
+
+class NoiseParityTest(unittest.TestCase):
+    seeds = (0, 1, 7, 42, 1234)
+    # (columns, rows), square and not
+    sizes = ((30, 30), (12, 20), (25, 9))
+
+    def test_initialize_map(self):
+        for seed in self.seeds:
+            for columns, rows in self.sizes:
+                expected = reference_initialize_map(columns, rows, 0.35, random.Random(seed).random)
+                grid = terrain_gen.initialize_map(columns, rows, 0.35, random.Random(seed).random)
+                np.testing.assert_array_equal(grid, expected)
+
+    def test_count_live_neighbors(self):
+        for seed in self.seeds:
+            for columns, rows in self.sizes:
+                grid = terrain_gen.initialize_map(columns, rows, 0.5, random.Random(seed).random)
+                expected = [[reference_count_live_neighbors(grid.tolist(), x, y) for y in range(rows)]
+                            for x in range(columns)]
+                np.testing.assert_array_equal(terrain_gen.count_live_neighbors(grid), expected)
+
+    def test_edge_rules(self):
+        # on an all-water map only the edges count: off-map columns are water,
+        # off-map rows are land, and the corners past both edges are water
+        counts = terrain_gen.count_live_neighbors(np.zeros((5, 4), dtype=np.uint8))
+        self.assertEqual(counts[2, 0], 3)   # top edge, three land cells above
+        self.assertEqual(counts[2, 3], 3)   # bottom edge
+        self.assertEqual(counts[0, 2], 0)   # left edge, three water cells beside
+        self.assertEqual(counts[4, 2], 0)   # right edge
+        self.assertEqual(counts[0, 0], 2)   # corner: two land above, the corner one is water
+        self.assertEqual(counts[4, 3], 2)
+        self.assertEqual(counts[2, 2], 0)   # inside
+
+    def test_sim_step(self):
+        for seed in self.seeds:
+            for columns, rows in self.sizes:
+                grid = terrain_gen.initialize_map(columns, rows, 0.35, random.Random(seed).random)
+                expected = reference_sim_step(grid.tolist(), 4, 3)
+                np.testing.assert_array_equal(terrain_gen.sim_step(grid, 4, 3), expected)
+
+    def test_generate_noise(self):
+        for seed in self.seeds:
+            for columns, rows in self.sizes:
+                expected = reference_generate_noise(columns, rows, 6, 4, 3, 0.35, random.Random(seed).random)
+                grid = terrain_gen.generate_noise(columns, rows, 6, 4, 3, 0.35, random.Random(seed).random)
+                np.testing.assert_array_equal(grid, expected)
+
+
+class ChunkProducerTest(unittest.TestCase):
+    def test_close_stops_an_idle_worker(self):
+        producer = terrain_gen.ChunkProducer()
+        producer.close()
+        self.assertFalse(producer._thread.is_alive())
+
+    def test_close_stops_a_worker_with_a_full_queue(self):
+        producer = terrain_gen.ChunkProducer(depth=2)
+        producer.reset(itertools.count())
+        self.assertEqual(producer.take(), 0)
+        self.assertEqual(producer.take(), 1)
+        # the worker is now waiting for room for a third chunk
+        producer.close()
+        self.assertFalse(producer._thread.is_alive())
+
+    def test_chunks_after_a_reset(self):
+        producer = terrain_gen.ChunkProducer(depth=2)
+        producer.reset(itertools.count())
+        producer.take()
+        producer.reset(itertools.count(100))
+        self.assertEqual(producer.take(), 100)
+        producer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()